@@ -1,15 +1,80 @@
 from temporalio import activity
-from pymongo import MongoClient
-import os
+from temporalio.exceptions import ApplicationError
+from storage.connection import get_collection
 from datetime import datetime
 
-# MongoDB setup
-mongo_client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = mongo_client['ecommerce_db']
-balances = db['balances']
+# The balance document only holds the running total and a short tail of recent
+# transactions (enough for the dashboard). The full history lives in the
+# balance_ledger collection, whose unique reference index is what makes debits
+# and credits idempotent.
+RECENT_TRANSACTIONS = 50
+
+def _record_in_ledger(user_id: str, transaction: dict, balance_after: float):
+    """Write a transaction to the ledger; keyed on its reference when it has one."""
+    ledger = get_collection('balance_ledger')
+    entry = dict(transaction, user_id=user_id, balance_after=balance_after)
+    if transaction.get('reference'):
+        ledger.update_one(
+            {'reference': transaction['reference']},
+            {'$setOnInsert': entry},
+            upsert=True
+        )
+    else:
+        ledger.insert_one(entry)
+
+def _apply_transaction(user_id: str, amount: float, transaction_type: str, reference: str = None, order_id: str = None, min_balance: float = None):
+    """
+    Apply a transaction to the balance document, then record it in the ledger.
+    
+    Args:
+        user_id: The ID of the user
+        amount: Signed amount to add to the balance
+        transaction_type: Type of transaction (e.g., 'payment', 'refund')
+        reference: Idempotency key; the update is skipped if it is already in the
+            recent tail (callers check the ledger first, see _ledger_entry)
+        order_id: Order the transaction belongs to, if any
+        min_balance: Only apply if the current balance is at least this much
+    
+    Returns:
+        The updated balance document, or None if no document matched
+    """
+    balances = get_collection('balances')
+    now = datetime.now()
+    transaction = {
+        'amount': amount,
+        'type': transaction_type,
+        'timestamp': now
+    }
+    query = {'user_id': user_id}
+    if min_balance is not None:
+        query['balance'] = {'$gte': min_balance}
+    if reference:
+        transaction['reference'] = reference
+        query['recent_transactions.reference'] = {'$ne': reference}
+    if order_id:
+        transaction['order_id'] = order_id
+    
+    result = balances.find_one_and_update(
+        query,
+        {
+            '$inc': {'balance': amount},
+            '$set': {'updated_at': now},
+            '$push': {
+                'recent_transactions': {
+                    '$each': [transaction],
+                    '$slice': -RECENT_TRANSACTIONS
+                }
+            }
+        },
+        projection={'recent_transactions': 0},
+        return_document=True
+    )
+    if result:
+        _record_in_ledger(user_id, transaction, result['balance'])
+    return result
 
 @activity.defn
-async def check_balance(user_id: str, amount: float) -> dict:
+def check_balance(user_id: str, amount: float) -> dict:
     """
     Check if user has sufficient balance for a transaction.
     
@@ -20,6 +85,8 @@ async def check_balance(user_id: str, amount: float) -> dict:
     Returns:
         dict: Balance check result
     """
+    balances = get_collection('balances')
+    
     # Get user's balance document
     balance_doc = balances.find_one({'user_id': user_id})
     
@@ -36,7 +103,7 @@ async def check_balance(user_id: str, amount: float) -> dict:
     }
 
 @activity.defn
-async def update_balance(user_id: str, amount: float, transaction_type: str) -> dict:
+def update_balance(user_id: str, amount: float, transaction_type: str) -> dict:
     """
     Update user's balance after a transaction.
     
@@ -48,24 +115,12 @@ async def update_balance(user_id: str, amount: float, transaction_type: str) ->
     Returns:
         dict: Update result
     """
-    # Update balance with optimistic locking
-    result = balances.find_one_and_update(
-        {
-            'user_id': user_id,
-            'balance': {'$gte': -amount if amount < 0 else 0}  # Ensure sufficient balance for deductions
-        },
-        {
-            '$inc': {'balance': amount},
-            '$set': {'updated_at': datetime.now()},
-            '$push': {
-                'transactions': {
-                    'amount': amount,
-                    'type': transaction_type,
-                    'timestamp': datetime.now()
-                }
-            }
-        },
-        return_document=True
+    # Ensure sufficient balance for deductions
+    result = _apply_transaction(
+        user_id,
+        amount,
+        transaction_type,
+        min_balance=-amount if amount < 0 else None
     )
     
     if not result:
@@ -76,4 +131,157 @@ async def update_balance(user_id: str, amount: float, transaction_type: str) ->
         'new_balance': result['balance'],
         'transaction_amount': amount,
         'transaction_type': transaction_type
-    } 
\ No newline at end of file
+    }
+
+def _ledger_entry(reference: str):
+    """
+    Return the ledger entry of an already applied transaction, or None.
+    
+    The recent tail on the balance document is capped, so a retry that arrives
+    after many other transactions would not find its reference there. The
+    ledger keeps every reference, so it is checked before applying.
+    """
+    return get_collection('balance_ledger').find_one(
+        {'reference': reference},
+        {'_id': 0, 'balance_after': 1}
+    )
+
+def _find_transaction(user_id: str, reference: str):
+    """Return the user's balance document with only the recent transaction matching reference (if any)."""
+    return get_collection('balances').find_one(
+        {'user_id': user_id},
+        {'balance': 1, 'recent_transactions': {'$elemMatch': {'reference': reference}}}
+    )
+
+def _already_applied(user_id: str, balance_doc: dict):
+    """Make sure a transaction found in the recent tail also reached the ledger."""
+    transaction = balance_doc['recent_transactions'][0]
+    _record_in_ledger(user_id, transaction, balance_doc.get('balance', 0.0))
+
+@activity.defn
+def debit_balance(user_id: str, order_id: str, amount: float) -> dict:
+    """
+    Atomically check and debit a user's balance for an order.
+    
+    The debit is keyed on the order id, so an activity retry after a
+    successful debit is a no-op rather than a second charge.
+    
+    Args:
+        user_id: The ID of the user
+        order_id: The order being paid for (idempotency key)
+        amount: The amount to debit (positive)
+    
+    Returns:
+        dict: Debit result
+    """
+    reference = f"debit:{order_id}"
+    
+    entry = _ledger_entry(reference)
+    if entry:
+        return {
+            'status': 'already_applied',
+            'new_balance': entry.get('balance_after', 0.0),
+            'transaction_amount': -amount,
+            'transaction_type': 'payment'
+        }
+    
+    # Single conditional update: enough funds and not already debited for this order
+    result = _apply_transaction(
+        user_id,
+        -amount,
+        'payment',
+        reference=reference,
+        order_id=order_id,
+        min_balance=amount
+    )
+    
+    if result:
+        return {
+            'status': 'success',
+            'new_balance': result['balance'],
+            'transaction_amount': -amount,
+            'transaction_type': 'payment'
+        }
+    
+    # Nothing matched: the debit was just applied by a concurrent attempt
+    # (still in the recent tail), or funds are insufficient
+    balance_doc = _find_transaction(user_id, reference)
+    if not balance_doc:
+        raise ApplicationError(
+            f"No balance found for user {user_id}. Please initialize the database.",
+            type="BalanceNotFound",
+            non_retryable=True
+        )
+    if balance_doc.get('recent_transactions'):
+        _already_applied(user_id, balance_doc)
+        return {
+            'status': 'already_applied',
+            'new_balance': balance_doc.get('balance', 0.0),
+            'transaction_amount': -amount,
+            'transaction_type': 'payment'
+        }
+    raise ApplicationError(
+        f"Insufficient balance. Required: {amount}, Available: {balance_doc.get('balance', 0.0)}",
+        type="InsufficientBalance",
+        non_retryable=True
+    )
+
+@activity.defn
+def credit_balance(user_id: str, order_id: str, amount: float, transaction_type: str = 'refund') -> dict:
+    """
+    Credit a user's balance for an order, e.g. to compensate a debit.
+    
+    Like debit_balance this is keyed on the order id, so it is applied at
+    most once per order no matter how often it is retried.
+    
+    Args:
+        user_id: The ID of the user
+        order_id: The order being refunded (idempotency key)
+        amount: The amount to credit (positive)
+        transaction_type: Type of transaction recorded in the history
+    
+    Returns:
+        dict: Credit result
+    """
+    reference = f"credit:{order_id}"
+    
+    entry = _ledger_entry(reference)
+    if entry:
+        return {
+            'status': 'already_applied',
+            'new_balance': entry.get('balance_after', 0.0),
+            'transaction_amount': amount,
+            'transaction_type': transaction_type
+        }
+    
+    result = _apply_transaction(
+        user_id,
+        amount,
+        transaction_type,
+        reference=reference,
+        order_id=order_id
+    )
+    
+    if result:
+        return {
+            'status': 'success',
+            'new_balance': result['balance'],
+            'transaction_amount': amount,
+            'transaction_type': transaction_type
+        }
+    
+    balance_doc = _find_transaction(user_id, reference)
+    if not balance_doc:
+        raise ApplicationError(
+            f"No balance found for user {user_id}. Please initialize the database.",
+            type="BalanceNotFound",
+            non_retryable=True
+        )
+    if balance_doc.get('recent_transactions'):
+        _already_applied(user_id, balance_doc)
+    return {
+        'status': 'already_applied',
+        'new_balance': balance_doc.get('balance', 0.0),
+        'transaction_amount': amount,
+        'transaction_type': transaction_type
+    }
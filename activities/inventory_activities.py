@@ -1,18 +1,30 @@
 from temporalio import activity
-from pymongo import MongoClient
-import random
-import time
+from temporalio.exceptions import ApplicationError
+from pymongo import UpdateOne
+from storage.connection import get_collection
+from storage.catalog import bump_catalog_version
+from datetime import datetime
+import simulation
 
-# MongoDB setup
-mongo_client = MongoClient('mongodb://localhost:27017/')
-db = mongo_client['ecommerce_db']
-inventory = db['inventory']
+# Reservations live in the inventory_reservations collection, one document per
+# (order_id, sku), so reserve/release are idempotent per order and a failed
+# reservation rolls back exactly the SKUs it decremented, however long ago the
+# order was placed. The stock itself stays on the inventory document.
+#
+# Stock and reservation are two documents, so each change goes through a
+# marker on the SKU that is written atomically with the stock $inc: `reserving`
+# lists orders whose decrement is applied but whose reservation is not yet
+# recorded, `releasing` orders whose increment is applied but whose
+# reservation is not yet removed. A retry after a crash between the two writes
+# reads the marker instead of applying the $inc again. Markers only live for
+# the duration of one activity, so the arrays stay tiny.
 
 @activity.defn
-async def check_inventory(items: list) -> dict:
-    # Simulate random failures (10% chance)
-    if random.random() < 0.1:
-        raise Exception("Inventory check failed")
+def check_inventory(items: list) -> dict:
+    # Simulate random failures (see simulation.py)
+    simulation.maybe_fail('inventory', "Inventory check failed")
+    
+    inventory = get_collection('inventory')
     
     # Check each item's stock
     for item in items:
@@ -21,7 +33,7 @@ async def check_inventory(items: list) -> dict:
             raise Exception(f"Insufficient stock for SKU {item['sku']}")
     
     # Simulate processing time
-    time.sleep(1)
+    simulation.simulate_delay('inventory')
     
     return {
         "status": "success",
@@ -29,15 +41,192 @@ async def check_inventory(items: list) -> dict:
     }
 
 @activity.defn
-async def update_inventory(items: list) -> dict:
+def update_inventory(items: list) -> dict:
+    inventory = get_collection('inventory')
+    
     # Update stock levels
     for item in items:
         inventory.update_one(
             {'sku': item['sku']},
             {'$inc': {'stock': -item['quantity']}}
         )
+    bump_catalog_version()
     
     return {
         "status": "success",
         "items_updated": len(items)
-    } 
\ No newline at end of file
+    }
+
+def _quantities_by_sku(items: list) -> dict:
+    """Sum quantities per SKU (a cart can contain the same SKU more than once)."""
+    quantities = {}
+    for item in items:
+        quantities[item['sku']] = quantities.get(item['sku'], 0) + item['quantity']
+    return quantities
+
+def _undo_decrements(inventory, order_id: str, quantities: dict) -> int:
+    """
+    Give back stock on every SKU whose decrement for order_id is applied but
+    not confirmed (still marked `reserving`). Returns the number of SKUs restored.
+    """
+    operations = [
+        UpdateOne(
+            {'sku': sku, 'reserving': order_id},
+            {'$inc': {'stock': quantity}, '$pull': {'reserving': order_id}}
+        )
+        for sku, quantity in quantities.items()
+    ]
+    if not operations:
+        return 0
+    return inventory.bulk_write(operations, ordered=False).modified_count
+
+def _release_legacy_holds(inventory, order_id: str, quantities: dict) -> int:
+    """Release stock of orders reserved before reservations had their own collection."""
+    operations = [
+        UpdateOne(
+            {'sku': sku, 'holds': order_id},
+            {'$inc': {'stock': quantity}, '$pull': {'holds': order_id}}
+        )
+        for sku, quantity in quantities.items()
+    ]
+    if not operations:
+        return 0
+    return inventory.bulk_write(operations, ordered=False).modified_count
+
+@activity.defn
+def reserve_inventory(order_id: str, items: list) -> dict:
+    """
+    Check and reserve stock for every item of an order.
+    
+    Each SKU is decremented with a conditional update, so stock can never go
+    negative, and recorded in inventory_reservations. A reservation takes
+    five round trips whatever the size of the cart: read the order's
+    reservations, decrement all SKUs, record them, drop the markers and bump
+    the catalog version. If another order wins the race for a SKU, the SKUs
+    already decremented are restored again before failing.
+    
+    Args:
+        order_id: The order reserving stock (idempotency key)
+        items: Order items with 'sku' and 'quantity'
+    
+    Returns:
+        dict: Reservation result
+    """
+    # Simulate random failures (see simulation.py)
+    simulation.maybe_fail('inventory', "Inventory check failed")
+    
+    inventory = get_collection('inventory')
+    reservations = get_collection('inventory_reservations')
+    quantities = _quantities_by_sku(items)
+    
+    # SKUs an earlier attempt already recorded
+    recorded = {doc['sku'] for doc in reservations.find({'order_id': order_id}, {'_id': 0, 'sku': 1})}
+    to_reserve = {sku: quantity for sku, quantity in quantities.items() if sku not in recorded}
+    
+    if to_reserve:
+        # One round trip for all SKUs; a decrement an earlier attempt applied
+        # is still marked and is not applied again
+        result = inventory.bulk_write([
+            UpdateOne(
+                {'sku': sku, 'stock': {'$gte': quantity}, 'reserving': {'$ne': order_id}},
+                {'$inc': {'stock': -quantity}, '$push': {'reserving': order_id}}
+            )
+            for sku, quantity in to_reserve.items()
+        ], ordered=False)
+        if result.modified_count < len(to_reserve):
+            # Out of stock, or a retry whose earlier attempt decremented some
+            # SKUs; only this path needs to read which SKUs carry the marker
+            marked = {
+                doc['sku']
+                for doc in inventory.find({'sku': {'$in': list(to_reserve)}, 'reserving': order_id}, {'_id': 0, 'sku': 1})
+            }
+            missing = [sku for sku in to_reserve if sku not in marked]
+            if missing:
+                _undo_decrements(inventory, order_id, to_reserve)
+                raise ApplicationError(
+                    f"Insufficient stock for SKU {missing[0]}",
+                    type="InsufficientStock",
+                    non_retryable=True
+                )
+        
+        now = datetime.utcnow()
+        reservations.bulk_write([
+            UpdateOne(
+                {'order_id': order_id, 'sku': sku},
+                {'$setOnInsert': {'quantity': quantity, 'state': 'held', 'created_at': now}},
+                upsert=True
+            )
+            for sku, quantity in to_reserve.items()
+        ], ordered=False)
+    
+    # The reservations are recorded; drop the markers, including any left
+    # behind by an earlier attempt
+    inventory.update_many({'sku': {'$in': list(quantities)}, 'reserving': order_id}, {'$pull': {'reserving': order_id}})
+    if to_reserve:
+        bump_catalog_version()
+    
+    return {
+        "status": "success",
+        "items_checked": len(items),
+        "skus_reserved": len(quantities)
+    }
+
+@activity.defn
+def release_inventory(order_id: str, items: list) -> dict:
+    """
+    Release stock reserved by reserve_inventory, e.g. when an order is compensated.
+    
+    Only SKUs with a reservation for the order, or with a decrement still
+    marked by a reservation that failed part way, are incremented, so this
+    is safe to retry.
+    
+    Args:
+        order_id: The order whose reservation is released
+        items: Order items with 'sku' and 'quantity'
+    
+    Returns:
+        dict: Release result
+    """
+    inventory = get_collection('inventory')
+    reservations = get_collection('inventory_reservations')
+    quantities = _quantities_by_sku(items)
+    docs = list(reservations.find({'order_id': order_id}, {'_id': 0, 'sku': 1, 'quantity': 1, 'state': 1}))
+    recorded = [doc['sku'] for doc in docs]
+    
+    # Decrements whose reservation was never recorded: restore only SKUs
+    # still marked, exactly like a failed reservation
+    released = _undo_decrements(
+        inventory,
+        order_id,
+        {sku: quantity for sku, quantity in quantities.items() if sku not in recorded}
+    )
+    if not docs:
+        released += _release_legacy_holds(inventory, order_id, quantities)
+    
+    # Held reservations: increment once per SKU (the marker guards retries),
+    # mark the reservations released, then drop the markers and reservations
+    to_release = {doc['sku']: doc['quantity'] for doc in docs if doc['state'] == 'held'}
+    if to_release:
+        result = inventory.bulk_write([
+            UpdateOne(
+                {'sku': sku, 'releasing': {'$ne': order_id}},
+                {'$inc': {'stock': quantity}, '$push': {'releasing': order_id}}
+            )
+            for sku, quantity in to_release.items()
+        ], ordered=False)
+        released += result.modified_count
+        reservations.update_many({'order_id': order_id, 'state': 'held'}, {'$set': {'state': 'released'}})
+    if recorded:
+        inventory.update_many(
+            {'sku': {'$in': recorded}, '$or': [{'releasing': order_id}, {'reserving': order_id}]},
+            {'$pull': {'releasing': order_id, 'reserving': order_id}}
+        )
+        reservations.delete_many({'order_id': order_id, 'state': 'released'})
+    
+    if released:
+        bump_catalog_version()
+    
+    return {
+        "status": "released",
+        "skus_released": released
+    }
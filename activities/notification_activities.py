@@ -1,15 +1,12 @@
 from temporalio import activity
-import random
 import time
+import simulation
 
 @activity.defn
-async def send_notification(user_id: str, order_id: str, notification_type: str) -> dict:
-    # Simulate random failures (10% chance)
-    if random.random() < 0.1:
-        raise Exception("Failed to send notification")
-    
-    # Simulate processing time
-    time.sleep(1)
+def send_notification(user_id: str, order_id: str, notification_type: str) -> dict:
+    # Simulate random failures and processing time (see simulation.py)
+    simulation.maybe_fail('notification', "Failed to send notification")
+    simulation.simulate_delay('notification')
     
     # Log notification (in a real app, this would send email/SMS)
     print(f"Notification sent to user {user_id} for order {order_id}: {notification_type}")
@@ -21,13 +18,10 @@ async def send_notification(user_id: str, order_id: str, notification_type: str)
     }
 
 @activity.defn
-async def update_user_rewards(points: int, tier: str) -> dict:
-    # Simulate random failures (5% chance)
-    if random.random() < 0.05:
-        raise Exception("Failed to update user rewards")
-    
-    # Simulate processing time
-    time.sleep(0.5)
+def update_user_rewards(points: int, tier: str) -> dict:
+    # Simulate random failures and processing time (see simulation.py)
+    simulation.maybe_fail('rewards_update', "Failed to update user rewards")
+    simulation.simulate_delay('rewards_update')
     
     # Log update (in a real app, this would update the database)
     print(f"Updated user rewards: points={points}, tier={tier}")
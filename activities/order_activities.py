@@ -1,15 +1,9 @@
 from temporalio import activity
-from pymongo import MongoClient
-import os
+from storage.connection import get_collection
 from datetime import datetime
 
-# MongoDB setup
-mongo_client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = mongo_client['ecommerce_db']
-orders = db['orders']
-
 @activity.defn
-async def update_order_status(order_id: str, status: str, details: dict = None) -> dict:
+def update_order_status(order_id: str, status: str, details: dict = None) -> dict:
     """
     Update the status of an order in the database.
     
@@ -34,6 +28,7 @@ async def update_order_status(order_id: str, status: str, details: dict = None)
             update_doc[key] = value
     
     # Update the order
+    orders = get_collection('orders')
     result = orders.update_one(
         {'order_id': order_id},
         {'$set': update_doc}
@@ -43,4 +38,55 @@ async def update_order_status(order_id: str, status: str, details: dict = None)
         "status": "success" if result.modified_count > 0 else "not_found",
         "order_id": order_id,
         "new_status": status
-    } 
\ No newline at end of file
+    } 
+
+@activity.defn
+def record_order_status(order_id: str, transitions: list) -> dict:
+    """
+    Persist a batch of status transitions for an order in a single write.
+
+    The order workflow buffers transitions and flushes them at checkpoints, so
+    one call here replaces several update_order_status round trips. The latest
+    transition becomes the order's status, every transition gets its
+    `{status}_at` timestamp and is appended to `status_history`.
+
+    Args:
+        order_id: The ID of the order
+        transitions: List of {'status', 'at' (ISO timestamp), 'details' (optional)} in order
+
+    Returns:
+        dict: The update result
+    """
+    if not transitions:
+        return {"status": "noop", "order_id": order_id}
+    
+    update_doc = {}
+    history = []
+    for transition in transitions:
+        status = transition['status']
+        at = datetime.fromisoformat(transition['at'])
+        update_doc[f"{status}_at"] = at
+        if transition.get('details'):
+            for key, value in transition['details'].items():
+                update_doc[key] = value
+        history.append({'status': status, 'at': at})
+    
+    update_doc['status'] = transitions[-1]['status']
+    # Time of the write (not of the transition) so pollers can rely on it
+    update_doc['updated_at'] = datetime.utcnow()
+    
+    orders = get_collection('orders')
+    result = orders.update_one(
+        {'order_id': order_id},
+        {
+            '$set': update_doc,
+            '$push': {'status_history': {'$each': history}}
+        }
+    )
+    
+    return {
+        "status": "success" if result.matched_count > 0 else "not_found",
+        "order_id": order_id,
+        "new_status": update_doc['status'],
+        "transitions_recorded": len(history)
+    }
@@ -1,18 +1,15 @@
 from temporalio import activity
-import random
 import time
+import simulation
 
 @activity.defn
-async def process_payment(user_id: str, order_id: str, items: list) -> dict:
+def process_payment(user_id: str, order_id: str, items: list) -> dict:
     # Simulate payment processing
     total = sum(item['price'] * item['quantity'] for item in items)
     
-    # Simulate random failures (20% chance)
-    if random.random() < 0.2:
-        raise Exception("Payment processing failed")
-    
-    # Simulate processing time
-    time.sleep(1)
+    # Simulate random failures and processing time (see simulation.py)
+    simulation.maybe_fail('payment', "Payment processing failed")
+    simulation.simulate_delay('payment')
     
     return {
         "status": "success",
@@ -21,9 +18,9 @@ async def process_payment(user_id: str, order_id: str, items: list) -> dict:
     }
 
 @activity.defn
-async def refund_payment(user_id: str, order_id: str) -> dict:
+def refund_payment(user_id: str, order_id: str) -> dict:
     # Simulate refund processing
-    time.sleep(1)
+    simulation.simulate_delay('refund')
     
     return {
         "status": "refunded",
@@ -1,74 +1,194 @@
 from temporalio import activity
-from pymongo import MongoClient
-import os
+from pymongo.errors import DuplicateKeyError
+from storage.connection import get_collection
+from temporal_client import get_temporal_client, TASK_QUEUE
+from workflows.rewards_workflow import CustomerRewardsWorkflow
 from datetime import datetime
 
-# MongoDB setup
-mongo_client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = mongo_client['ecommerce_db']
-rewards = db['rewards']
+# Only the most recent points_history entries are kept on the rewards
+# document so its size stays constant for heavy buyers
+POINTS_HISTORY_LIMIT = 100
+
+# Ids of the most recently applied batches, kept to make update_user_rewards
+# idempotent. CustomerRewardsWorkflow persists one batch at a time and retries
+# a failed one before the next, so only a late, timed-out attempt can arrive
+# after newer batches; this many of them is ample margin.
+APPLIED_BATCHES_LIMIT = 50
+
+# Tier thresholds, highest first (same as CustomerRewardsWorkflow._calculate_tier)
+TIER_THRESHOLDS = [
+    (1000, 'platinum'),
+    (500, 'gold'),
+    (100, 'silver')
+]
+
+def tier_for(points: int) -> str:
+    """Tier for a number of points, for documents built outside a pipeline."""
+    for threshold, tier in TIER_THRESHOLDS:
+        if points >= threshold:
+            return tier
+    return 'basic'
+
+def tier_expression(points_expression) -> dict:
+    """Aggregation expression computing the tier for the given points expression."""
+    return {
+        '$switch': {
+            'branches': [
+                {'case': {'$gte': [points_expression, threshold]}, 'then': tier}
+                for threshold, tier in TIER_THRESHOLDS
+            ],
+            'default': 'basic'
+        }
+    }
 
 @activity.defn
-async def update_user_rewards(user_id: str, points_to_add: int) -> dict:
+def update_user_rewards(user_id: str, points_to_add: int, batch_id: str = None) -> dict:
     """
     Update user rewards in MongoDB.
     Creates a new rewards document if user doesn't exist,
     or updates existing rewards by adding points.
     
+    Points, the capped history and the tier are all updated by one
+    pipeline update, so this is a single atomic write. The document is only
+    inserted when the user has none yet, so a retried batch can never create
+    a second rewards document, with or without the unique user_id index.
+    
     Args:
         user_id: The ID of the user
         points_to_add: Number of points to add to user's rewards
+        batch_id: Idempotency key; a batch that was already applied is not added again
     
     Returns:
         dict: Updated rewards information
     """
+    rewards = get_collection('rewards')
+    now = datetime.now()
+    history_entry = {
+        'points': points_to_add,
+        'timestamp': now,
+        'type': 'order_purchase'
+    }
+    query = {'user_id': user_id}
+    applied_batches = {}
+    if batch_id:
+        # A document that already has this batch does not match
+        query['applied_batches'] = {'$ne': batch_id}
+        applied_batches = {
+            'applied_batches': {
+                '$slice': [
+                    {'$concatArrays': [{'$ifNull': ['$applied_batches', []]}, [batch_id]]},
+                    -APPLIED_BATCHES_LIMIT
+                ]
+            }
+        }
+    update = [
+        {'$set': {
+            'created_at': {'$ifNull': ['$created_at', now]},
+            'updated_at': now,
+            'total_points': {'$add': [{'$ifNull': ['$total_points', 0]}, points_to_add]},
+            'points_history': {
+                '$slice': [
+                    {'$concatArrays': [{'$ifNull': ['$points_history', []]}, [{'$literal': history_entry}]]},
+                    -POINTS_HISTORY_LIMIT
+                ]
+            },
+            **applied_batches
+        }},
+        # Runs after the stage above, so it sees the new total
+        {'$set': {'tier': tier_expression('$total_points')}}
+    ]
+    
     try:
-        # Try to find existing rewards document
-        result = rewards.find_one_and_update(
-            {'user_id': user_id},
-            {
-                '$inc': {'total_points': points_to_add},
-                '$push': {
-                    'points_history': {
-                        'points': points_to_add,
-                        'timestamp': datetime.now(),
-                        'type': 'order_purchase'
-                    }
-                },
-                '$setOnInsert': {
+        while True:
+            result = rewards.find_one_and_update(
+                query,
+                update,
+                projection={'_id': 0, 'total_points': 1, 'tier': 1},
+                return_document=True
+            )
+            if result is not None:
+                return {
+                    'status': 'success',
                     'user_id': user_id,
-                    'created_at': datetime.now()
+                    'total_points': result['total_points'],
+                    'points_added': points_to_add,
+                    'current_tier': result['tier']
                 }
-            },
-            upsert=True,
-            return_document=True
-        )
-        
-        # Calculate reward tier based on total points
-        total_points = result.get('total_points', points_to_add)
-        tier = 'basic'
-        if total_points >= 1000:
-            tier = 'platinum'
-        elif total_points >= 500:
-            tier = 'gold'
-        elif total_points >= 100:
-            tier = 'silver'
             
-        # Update tier if needed
-        if result.get('tier', '').lower() != tier:
-            rewards.update_one(
-                {'user_id': user_id},
-                {'$set': {'tier': tier}}
-            )
-        
-        return {
-            'status': 'success',
-            'user_id': user_id,
-            'total_points': total_points,
-            'points_added': points_to_add,
-            'current_tier': tier
-        }
+            current = rewards.find_one({'user_id': user_id}, {'_id': 0, 'total_points': 1, 'tier': 1})
+            if current is not None:
+                # The document exists but did not match: an earlier attempt of
+                # this batch already wrote it
+                return {
+                    'status': 'already_applied',
+                    'user_id': user_id,
+                    'total_points': current['total_points'],
+                    'points_added': 0,
+                    'current_tier': current['tier']
+                }
+            
+            # First points for this user; $setOnInsert leaves a document
+            # created concurrently alone, and the loop then updates that one
+            try:
+                inserted = rewards.update_one(
+                    {'user_id': user_id},
+                    {'$setOnInsert': {
+                        'user_id': user_id,
+                        'created_at': now,
+                        'updated_at': now,
+                        'total_points': points_to_add,
+                        'points_history': [history_entry],
+                        'tier': tier_for(points_to_add),
+                        **({'applied_batches': [batch_id]} if batch_id else {})
+                    }},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                continue
+            if inserted.upserted_id is not None:
+                return {
+                    'status': 'success',
+                    'user_id': user_id,
+                    'total_points': points_to_add,
+                    'points_added': points_to_add,
+                    'current_tier': tier_for(points_to_add)
+                }
         
     except Exception as e:
         print(f"Error updating rewards: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+@activity.defn
+async def signal_rewards(user_id: str, order_id: str, points: int) -> dict:
+    """
+    Deliver reward points to the user's CustomerRewardsWorkflow using
+    signal-with-start, so the workflow is created on the user's first order
+    and signalled in the same round trip otherwise.
+    
+    This activity is async because it only awaits the Temporal client; it
+    runs on the worker's event loop rather than the activity thread pool.
+    
+    Args:
+        user_id: The ID of the user
+        order_id: The order the points are for (lets the workflow drop duplicate signals)
+        points: Number of points to add
+    
+    Returns:
+        dict: Signal result
+    """
+    client = await get_temporal_client()
+    rewards_id = f"rewards_{user_id}"
+    await client.start_workflow(
+        CustomerRewardsWorkflow.run,
+        user_id,
+        id=rewards_id,
+        task_queue=TASK_QUEUE,
+        start_signal="add_points",
+        start_signal_args=[points, order_id]
+    )
+    
+    return {
+        'status': 'signalled',
+        'workflow_id': rewards_id,
+        'points_added': points
+    }
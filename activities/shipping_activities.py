@@ -1,15 +1,13 @@
 from temporalio import activity
 import random
 import time
+import simulation
 
 @activity.defn
-async def generate_shipping_label(item: dict) -> str:
-    # Simulate random failures (15% chance)
-    if random.random() < 0.15:
-        raise Exception("Failed to generate shipping label")
-    
-    # Simulate processing time
-    time.sleep(1)
+def generate_shipping_label(item: dict) -> str:
+    # Simulate random failures and processing time (see simulation.py)
+    simulation.maybe_fail('shipping_label', "Failed to generate shipping label")
+    simulation.simulate_delay('shipping_label')
     
     # Generate tracking number
     tracking_number = f"TRK{int(time.time())}{random.randint(1000, 9999)}"
@@ -17,13 +15,27 @@ async def generate_shipping_label(item: dict) -> str:
     return tracking_number
 
 @activity.defn
-async def schedule_pickup(tracking_number: str) -> dict:
-    # Simulate random failures (10% chance)
-    if random.random() < 0.1:
-        raise Exception("Failed to schedule pickup")
+def generate_parcel_label(parcel: dict) -> str:
+    """
+    Generate one shipping label for every item in a parcel.
+    
+    Args:
+        parcel: Parcel with 'parcel_id', 'warehouse' and 'items'
+    
+    Returns:
+        str: Tracking number of the parcel
+    """
+    # Simulated failures and processing time apply once per parcel rather than per item
+    simulation.maybe_fail('shipping_label', "Failed to generate shipping label")
+    simulation.simulate_delay('shipping_label')
     
-    # Simulate processing time
-    time.sleep(1)
+    return f"TRK{int(time.time())}{random.randint(1000, 9999)}"
+
+@activity.defn
+def schedule_pickup(tracking_number: str) -> dict:
+    # Simulate random failures and processing time (see simulation.py)
+    simulation.maybe_fail('pickup', "Failed to schedule pickup")
+    simulation.simulate_delay('pickup')
     
     return {
         "status": "scheduled",
@@ -32,13 +44,10 @@ async def schedule_pickup(tracking_number: str) -> dict:
     }
 
 @activity.defn
-async def mark_delivered(tracking_number: str) -> dict:
-    # Simulate random failures (5% chance)
-    if random.random() < 0.05:
-        raise Exception("Failed to mark as delivered")
-    
-    # Simulate processing time
-    time.sleep(1)
+def mark_delivered(tracking_number: str) -> dict:
+    # Simulate random failures and processing time (see simulation.py)
+    simulation.maybe_fail('delivery', "Failed to mark as delivered")
+    simulation.simulate_delay('delivery')
     
     return {
         "status": "delivered",
@@ -1,59 +1,76 @@
 from aiohttp import web
 import aiohttp_jinja2
 import jinja2
-from pymongo import MongoClient
 from datetime import datetime
 import os
 from dotenv import load_dotenv
-from temporalio.client import Client
 import asyncio
+import base64
 import json
+from bson import ObjectId
+import serialization
+import simulation
 from workflows.order_workflow import OrderProcessingWorkflow, OrderRequest
 from workflows.rewards_workflow import CustomerRewardsWorkflow
+from storage.repositories import (
+    OrdersRepository,
+    InventoryRepository,
+    CatalogVersionsRepository,
+    BalancesRepository,
+    BalanceLedgerRepository,
+    RewardsRepository,
+    get_executor,
+    shutdown_executor
+)
+from storage.connection import close_client, health as mongo_health
+from storage.indexes import report_missing_indexes
+from storage.cache import TTLCache
+from storage.catalog import InventoryCatalog
+from storage.order_events import OrderEventHub, TERMINAL_STATUSES
+from temporal_client import get_temporal_client, TASK_QUEUE
+from temporalio.client import WorkflowExecutionStatus
+from temporalio.common import WorkflowIDReusePolicy
+from temporalio.exceptions import WorkflowAlreadyStartedError
 
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Idempotency-Key'
+}
 
-def json_response(data, **kwargs):
+def json_response(data, request=None, **kwargs):
+    """
+    Build a JSON response with the CORS headers.
+
+    Pass the request for list endpoints whose bodies can get large: the body
+    is then compressed when it is over the size threshold and the client
+    accepts gzip or brotli.
+    """
     headers = kwargs.pop('headers', {})
-    headers.update({
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type'
-    })
-    return web.json_response(data, headers=headers, dumps=lambda x: json.dumps(x, cls=DateTimeEncoder), **kwargs)
+    headers.update(CORS_HEADERS)
+    body = serialization.dumps(data)
+    if request is not None:
+        headers['Vary'] = 'Accept-Encoding'
+        body, encoding = serialization.compress(body, request.headers.get('Accept-Encoding', ''))
+        if encoding:
+            headers['Content-Encoding'] = encoding
+    return web.Response(body=body, headers=headers, content_type='application/json', charset='utf-8', **kwargs)
 
 # Load environment variables
 load_dotenv()
 
-# MongoDB setup
-mongo_client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = mongo_client['ecommerce_db']
+# Repositories - all Mongo access from the handlers goes through these so that
+# blocking pymongo calls never run on the event loop. They share the process-wide
+# MongoClient from storage.connection.
+orders_repo = OrdersRepository()
+inventory_repo = InventoryRepository()
+rewards_repo = RewardsRepository()
+balances_repo = BalancesRepository()
+balance_ledger_repo = BalanceLedgerRepository()
 
-# Collections
-orders = db['orders']
-inventory = db['inventory']
-rewards = db['rewards']
-balances = db['balances']
-
-# Temporal client setup
-temporal_client = None
-
-async def get_temporal_client():
-    global temporal_client
-    if temporal_client is None:
-        try:
-            temporal_client = await Client.connect("localhost:7233")
-            print("Successfully connected to Temporal server")
-        except Exception as e:
-            print(f"Failed to connect to Temporal server: {str(e)}")
-            print("Please ensure Temporal server is running on localhost:7233")
-            print("You can start it using: docker run -d -p 7233:7233 -p 7234:7234 -p 7235:7235 temporalio/auto-setup:1.20")
-            raise
-    return temporal_client
+# GET /rewards is polled by the dashboard; serve it from the rewards collection
+# through a short-lived cache instead of querying the workflow on every request
+rewards_cache = TTLCache(float(os.getenv('REWARDS_CACHE_TTL', '5')))
 
 # Routes
 @aiohttp_jinja2.template('index.html')
@@ -61,12 +78,105 @@ async def index(request):
     return {}
 
 async def get_inventory_handler(request):
-    items = list(inventory.find({}, {'_id': 0}))
-    return json_response(items)
+    # Served from the in-process catalog; browsers and CDNs revalidate with
+    # If-None-Match / If-Modified-Since and get a 304 while stock is unchanged
+    catalog = await request.app['inventory_catalog'].get()
+    encoding = serialization.select_encoding(catalog.body, request.headers.get('Accept-Encoding', ''))
+    headers = dict(CORS_HEADERS, **{'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'})
+    
+    if catalog.not_modified(request.if_none_match, request.if_modified_since):
+        response = web.Response(status=304, headers=headers)
+    else:
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        response = web.Response(
+            body=catalog.encode(encoding),
+            headers=headers,
+            content_type='application/json',
+            charset='utf-8'
+        )
+    response.etag = catalog.etag_for(encoding)
+    if catalog.last_modified:
+        response.last_modified = catalog.last_modified
+    return response
+
+ORDERS_DEFAULT_LIMIT = 50
+ORDERS_MAX_LIMIT = 500
+
+def encode_cursor(timestamp, tiebreaker):
+    # Opaque keyset cursor pointing at the last document of a page
+    raw = json.dumps([timestamp.isoformat(), tiebreaker])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    timestamp, tiebreaker = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(timestamp), tiebreaker
 
 async def get_orders_handler(request):
-    orders_list = list(orders.find({}, {'_id': 0}))
-    return json_response(orders_list)
+    try:
+        limit = int(request.query.get('limit', ORDERS_DEFAULT_LIMIT))
+        if limit < 1 or limit > ORDERS_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {ORDERS_MAX_LIMIT}")
+        after = request.query.get('after')
+        after = decode_cursor(after) if after else None
+    except Exception as e:
+        return json_response({'error': f'Invalid pagination parameters: {str(e)}'}, status=400)
+
+    statuses = [s for s in request.query.get('status', '').split(',') if s]
+    fields = [f for f in request.query.get('fields', '').split(',') if f]
+    if fields == ['all']:
+        fields = list(OrdersRepository.DETAIL_FIELDS)
+    unknown = set(fields) - set(OrdersRepository.DETAIL_FIELDS)
+    if unknown:
+        return json_response({'error': f"Unknown fields: {', '.join(sorted(unknown))}"}, status=400)
+
+    orders_list = await orders_repo.list_orders(limit=limit, after=after, statuses=statuses, fields=fields)
+    next_cursor = None
+    if len(orders_list) == limit:
+        next_cursor = encode_cursor(orders_list[-1]['created_at'], orders_list[-1]['order_id'])
+    return json_response({
+        'orders': orders_list,
+        'next_cursor': next_cursor
+    }, request)
+
+EXPORT_BATCH_SIZE = 500
+
+def parse_export_date(value):
+    # Accepts a date (2024-04-01) or a full ISO timestamp
+    return datetime.fromisoformat(value) if value else None
+
+async def export_orders_handler(request):
+    try:
+        date_from = parse_export_date(request.query.get('from'))
+        date_to = parse_export_date(request.query.get('to'))
+    except ValueError as e:
+        return json_response({'error': f'Invalid date range: {str(e)}'}, status=400)
+
+    query = {}
+    statuses = [s for s in request.query.get('status', '').split(',') if s]
+    if statuses:
+        query['status'] = {'$in': statuses}
+    if date_from or date_to:
+        query['created_at'] = {}
+        if date_from:
+            query['created_at']['$gte'] = date_from
+        if date_to:
+            query['created_at']['$lt'] = date_to
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/x-ndjson',
+        'Content-Disposition': 'attachment; filename="orders.ndjson"',
+        'Access-Control-Allow-Origin': '*'
+    })
+    await response.prepare(request)
+
+    # Write one JSON document per line, a batch at a time, so memory use does
+    # not depend on the size of the export
+    async for batch in orders_repo.iter_order_batches(query, batch_size=EXPORT_BATCH_SIZE):
+        await response.write(serialization.dumps_lines(batch))
+
+    await response.write_eof()
+    return response
 
 async def get_balance_handler(request):
     try:
@@ -74,7 +184,7 @@ async def get_balance_handler(request):
         user_id = "default_user"
         
         # Get balance from MongoDB
-        balance_doc = balances.find_one({'user_id': user_id})
+        balance_doc = await balances_repo.get_balance(user_id)
         
         if not balance_doc:
             return json_response({
@@ -83,12 +193,12 @@ async def get_balance_handler(request):
                 'transactions': []
             }, status=404)
         
-        # Get transaction history
-        transactions = balance_doc.get('transactions', [])
+        # Last 5 transactions from the capped tail on the balance document
+        transactions = balance_doc.get('recent_transactions') or balance_doc.get('transactions') or []
         
         return json_response({
             'balance': balance_doc.get('balance', 0.0),
-            'transactions': transactions[-5:] if transactions else []  # Return last 5 transactions
+            'transactions': transactions
         })
     except Exception as e:
         print(f"Error fetching balance: {str(e)}")
@@ -98,47 +208,87 @@ async def get_balance_handler(request):
             'transactions': []
         }, status=500)
 
+TRANSACTIONS_DEFAULT_LIMIT = 20
+TRANSACTIONS_MAX_LIMIT = 200
+
+async def get_balance_transactions_handler(request):
+    # For demo purposes, using a default user ID
+    user_id = "default_user"
+    
+    try:
+        limit = int(request.query.get('limit', TRANSACTIONS_DEFAULT_LIMIT))
+        if limit < 1 or limit > TRANSACTIONS_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {TRANSACTIONS_MAX_LIMIT}")
+        before = request.query.get('before')
+        if before:
+            timestamp, entry_id = decode_cursor(before)
+            before = (timestamp, ObjectId(entry_id))
+    except Exception as e:
+        return json_response({'error': f'Invalid pagination parameters: {str(e)}'}, status=400)
+    
+    transactions = await balance_ledger_repo.list_transactions(user_id, limit=limit, before=before)
+    next_cursor = None
+    if len(transactions) == limit:
+        next_cursor = encode_cursor(transactions[-1]['timestamp'], str(transactions[-1]['_id']))
+    for transaction in transactions:
+        del transaction['_id']
+    
+    return json_response({
+        'transactions': transactions,
+        'next_cursor': next_cursor
+    }, request)
+
+def calculate_tier(total_points):
+    """Calculate tier based on points (same thresholds as CustomerRewardsWorkflow)."""
+    if total_points >= 1000:
+        return "platinum"
+    elif total_points >= 500:
+        return "gold"
+    elif total_points >= 100:
+        return "silver"
+    return "basic"
+
+async def query_rewards_workflow(user_id):
+    # Live state from the user's rewards workflow; costs a workflow task on a worker
+    client = await get_temporal_client()
+    handle = client.get_workflow_handle_for(CustomerRewardsWorkflow.run, "rewards_"+user_id)  
+    results = await handle.query(CustomerRewardsWorkflow.get_status)  
+    total_points = results.get('points', 0) if results else 0
+    return {
+        'points': total_points,
+        'tier': calculate_tier(total_points)
+    }
+
 async def get_rewards_handler(request):
     try:
         # For demo purposes, using a default user ID
         user_id = "default_user"
         
-        # Get rewards from MongoDB
-        #user_rewards = rewards.find_one({'user_id': user_id})
-
-        # Instead of getting the rewards from MongoDB, I will get it from the rewards workflow
-        # Get the rewards from the rewards workflow
-        # rewards_workflow = CustomerRewardsWorkflow()
-        # rewards_workflow.run(user_id)
-        # using the get_status query
-
-        client = await get_temporal_client()
-        handle = client.get_workflow_handle_for(CustomerRewardsWorkflow.run, "rewards_"+user_id)  
-        results = await handle.query(CustomerRewardsWorkflow.get_status)  
+        # ?consistent=true bypasses the read model and asks the workflow directly
+        if request.query.get('consistent', '').lower() in ('1', 'true', 'yes'):
+            rewards_status = await query_rewards_workflow(user_id)
+            rewards_cache.set(user_id, rewards_status)
+            return json_response(rewards_status)
         
-        if results:
-            total_points = results.get('points', 0)
-            #total_points = user_rewards.get('total_points', 0)
-            
-            # Calculate tier based on points
-            if total_points >= 1000:
-                tier = "platinum"
-            elif total_points >= 500:
-                tier = "gold"
-            elif total_points >= 100:
-                tier = "silver"
+        rewards_status = rewards_cache.get(user_id)
+        if rewards_status is None:
+            # Read model maintained by the update_user_rewards activity
+            user_rewards = await rewards_repo.get_rewards(user_id)
+            if user_rewards:
+                total_points = user_rewards.get('total_points', 0)
+                rewards_status = {
+                    'points': total_points,
+                    'tier': user_rewards.get('tier') or calculate_tier(total_points)
+                }
             else:
-                tier = "basic"
-                
-            return json_response({
-                'points': total_points,
-                'tier': tier
-            })
-        else:
-            return json_response({
-                'points': 0,
-                'tier': 'basic'
-            })
+                # Nothing persisted yet; fall back to the workflow if it exists
+                try:
+                    rewards_status = await query_rewards_workflow(user_id)
+                except Exception:
+                    rewards_status = {'points': 0, 'tier': 'basic'}
+            rewards_cache.set(user_id, rewards_status)
+        
+        return json_response(rewards_status)
     except Exception as e:
         print(f"Error fetching rewards: {str(e)}")
         return json_response({
@@ -147,6 +297,113 @@ async def get_rewards_handler(request):
             'tier': 'basic'
         }, status=500)
 
+def build_order(items, user_id, idempotency_key=None):
+    # The id is generated here so the order is written in a single insert
+    # together with its order_id
+    order_oid = ObjectId()
+    now = datetime.utcnow()
+    order = {
+        '_id': order_oid,
+        'order_id': str(order_oid),
+        'user_id': user_id,
+        'items': items,
+        'status': 'initiated',
+        'total': sum(item['price'] * item['quantity'] for item in items),
+        'created_at': now,
+        'updated_at': now
+    }
+    if idempotency_key:
+        order['idempotency_key'] = idempotency_key
+    return order
+
+# How new orders ship: "parcel" (items grouped into parcels, one shipping
+# workflow per parcel) or "per_item" (one shipping workflow per line item)
+SHIPPING_MODE = os.getenv('SHIPPING_MODE', 'parcel')
+PARCEL_MAX_ITEMS = int(os.getenv('PARCEL_MAX_ITEMS', '10'))
+
+async def start_order_workflow(client, order):
+    # The workflow id is derived from the order id and may never be reused,
+    # so a replayed request cannot start a second workflow for the same order,
+    # even after the first one has closed
+    workflow_id = f"order_{order['order_id']}"
+    try:
+        await client.start_workflow(
+            OrderProcessingWorkflow,
+            OrderRequest(
+                user_id=order['user_id'],
+                order_id=order['order_id'],
+                items=order['items'],
+                shipping_mode=SHIPPING_MODE,
+                max_items_per_parcel=PARCEL_MAX_ITEMS,
+                shipping_delays=simulation.workflow_delays()
+            ),
+            id=workflow_id,
+            task_queue=TASK_QUEUE,
+            id_reuse_policy=WorkflowIDReusePolicy.REJECT_DUPLICATE,
+        )
+    except WorkflowAlreadyStartedError:
+        pass
+    return workflow_id
+
+CHECKOUT_MAX_TIMEOUT = 30
+
+def parse_checkout_timeout(value=None):
+    """
+    Parse the ?timeout= of a synchronous checkout.
+    
+    Raises ValueError for anything that is not a positive number of seconds.
+    """
+    timeout = float(value or os.getenv('CHECKOUT_SYNC_TIMEOUT', '10'))
+    if not timeout > 0:
+        raise ValueError("timeout must be a positive number of seconds")
+    return min(timeout, CHECKOUT_MAX_TIMEOUT)
+
+async def closed_checkout_result(handle):
+    """
+    Checkout outcome of an order workflow that no longer accepts updates.
+    
+    A replayed Idempotency-Key can refer to an order whose workflow has already
+    closed; its outcome is read from the workflow result instead.
+    """
+    description = await handle.describe()
+    if description.status == WorkflowExecutionStatus.RUNNING:
+        return None
+    if description.status != WorkflowExecutionStatus.COMPLETED:
+        return {'status': 'failed', 'error': f"Workflow {description.status.name.lower()}"}
+    result = await handle.result()
+    if result.get('status') == 'completed':
+        return {
+            'status': 'confirmed',
+            'order_id': result.get('order_id'),
+            'payment_status': result.get('payment_status'),
+            'inventory_status': result.get('inventory_status')
+        }
+    return dict(result, status='failed')
+
+async def wait_for_checkout(client, workflow_id, timeout):
+    """
+    Wait on the order workflow's wait_for_checkout update.
+    
+    Returns the workflow's checkout result, or {'status': 'pending'} if it
+    does not arrive within the timeout (the order keeps processing).
+    """
+    handle = client.get_workflow_handle(workflow_id)
+    try:
+        return await asyncio.wait_for(
+            handle.execute_update(OrderProcessingWorkflow.wait_for_checkout),
+            timeout
+        )
+    except asyncio.TimeoutError:
+        return {'status': 'pending', 'reason': 'timeout'}
+    except Exception as e:
+        print(f"Failed to wait for checkout: {str(e)}")
+        try:
+            checkout = await closed_checkout_result(handle)
+        except Exception as describe_error:
+            print(f"Failed to read workflow outcome: {str(describe_error)}")
+            checkout = None
+        return checkout or {'status': 'pending', 'reason': str(e)}
+
 async def place_order(request):
     try:
         data = await request.json()
@@ -154,51 +411,241 @@ async def place_order(request):
             return json_response({'error': 'Invalid request data'}, status=400)
 
         items = data['items']
+        # For demo purposes, using a default user ID
+        user_id = "default_user"
         
-        # Create order record
-        order = {
-            'items': items,
-            'status': 'initiated',
-            'total': sum(item['price'] * item['quantity'] for item in items),
-            'created_at': datetime.utcnow()
-        }
-        result = orders.insert_one(order)
-        order_id = str(result.inserted_id)
+        # Validate the query before the order is stored
+        sync = request.query.get('sync', '').lower() in ('1', 'true', 'yes')
+        if sync:
+            try:
+                timeout = parse_checkout_timeout(request.query.get('timeout'))
+            except ValueError as e:
+                return json_response({'error': f'Invalid timeout: {str(e)}'}, status=400)
         
-        # Update order with the order_id for easier reference
-        orders.update_one(
-            {'_id': result.inserted_id},
-            {'$set': {'order_id': order_id}}
-        )
+        # Create order record. A retried POST with the same Idempotency-Key
+        # gets the original order back.
+        order = build_order(items, user_id, request.headers.get('Idempotency-Key'))
+        order, created = await orders_repo.insert_order(order)
+        order_id = order['order_id']
+        workflow_id = f"order_{order_id}"
         
         # Start order processing workflow
+        start_error = None
         try:
             client = await get_temporal_client()
-            workflow_id = f"order_{order_id}"
-            await client.start_workflow(
-                OrderProcessingWorkflow,
-                OrderRequest(
-                    user_id="default_user",
-                    order_id=order_id,
-                    items=items
-                ),
-                id=workflow_id,
-                task_queue="ecommerce-task-queue",
-            )
+            await start_order_workflow(client, order)
         except Exception as e:
             print(f"Failed to start workflow: {str(e)}")
             # Still return success as order is created
-            pass
+            start_error = f"Failed to start workflow: {str(e)}"
         
-        return json_response({
+        headers = {} if created else {'Idempotent-Replayed': 'true'}
+        body = {
             'message': 'Order placed successfully', 
             'order_id': order_id,
-            'workflow_id': f"order_{order_id}"
-        })
+            'workflow_id': workflow_id
+        }
+        
+        # ?sync=true waits for payment and inventory reservation and returns
+        # the outcome in this response instead of having the client poll
+        if sync:
+            if start_error:
+                # The order is stored but nothing is processing it yet
+                body['checkout'] = {'status': 'pending', 'reason': start_error}
+                return json_response(body, status=202, headers=headers)
+            checkout = await wait_for_checkout(client, workflow_id, timeout)
+            body['checkout'] = checkout
+            if checkout['status'] == 'failed':
+                body['message'] = 'Order failed'
+                return json_response(body, status=402, headers=headers)
+            if checkout['status'] == 'pending':
+                return json_response(body, status=202, headers=headers)
+        
+        return json_response(body, headers=headers)
     except Exception as e:
         print(f"Error placing order: {str(e)}")
         return json_response({'error': str(e)}, status=500)
 
+BULK_ORDER_MAX_ORDERS = 10000
+BULK_ORDER_MAX_CONCURRENCY = 200
+
+def validate_order_items(items):
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+    for item in items:
+        if not all(key in item for key in ('sku', 'price', 'quantity')):
+            raise ValueError("every item needs sku, price and quantity")
+
+async def place_bulk_orders(request):
+    """
+    Create many orders at once and start their workflows.
+    
+    Body: {"orders": [{"items": [...], "user_id": "...", "idempotency_key": "..."}, ...]}
+    Query: concurrency (parallel workflow starts), stream=true for NDJSON progress
+    """
+    try:
+        data = await request.json(loads=serialization.loads)
+        entries = data.get('orders') if isinstance(data, dict) else None
+        if not isinstance(entries, list) or not entries:
+            raise ValueError("orders must be a non-empty list")
+        if len(entries) > BULK_ORDER_MAX_ORDERS:
+            raise ValueError(f"at most {BULK_ORDER_MAX_ORDERS} orders per request")
+        concurrency = int(request.query.get('concurrency', os.getenv('BULK_ORDER_CONCURRENCY', '50')))
+        if concurrency < 1 or concurrency > BULK_ORDER_MAX_CONCURRENCY:
+            raise ValueError(f"concurrency must be between 1 and {BULK_ORDER_MAX_CONCURRENCY}")
+    except Exception as e:
+        return json_response({'error': f'Invalid request data: {str(e)}'}, status=400)
+    stream = request.query.get('stream', '').lower() in ('1', 'true', 'yes')
+    
+    # Validate every entry up front; invalid ones are reported, not inserted
+    results = [None] * len(entries)
+    orders = []
+    positions = []
+    for index, entry in enumerate(entries):
+        try:
+            validate_order_items(entry.get('items'))
+            orders.append(build_order(
+                entry['items'],
+                entry.get('user_id', 'default_user'),
+                entry.get('idempotency_key')
+            ))
+            positions.append(index)
+        except Exception as e:
+            results[index] = {'index': index, 'status': 'invalid', 'error': str(e)}
+    
+    # One insert_many round trip for all valid orders
+    inserted = await orders_repo.insert_orders(orders) if orders else []
+    
+    # The orders are stored now; if Temporal is unreachable they are reported
+    # as created without a workflow, like POST /order does
+    try:
+        client = await get_temporal_client()
+        client_error = None
+    except Exception as e:
+        client = None
+        client_error = f"Failed to start workflow: {str(e)}"
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def start(index, order, created, error):
+        if error:
+            return {'index': index, 'status': 'failed', 'error': error}
+        result = {
+            'index': index,
+            'order_id': order['order_id'],
+            'status': 'started' if created else 'replayed'
+        }
+        if client is None:
+            result['status'] = 'created'
+            result['error'] = client_error
+            return result
+        async with semaphore:
+            try:
+                result['workflow_id'] = await start_order_workflow(client, order)
+            except Exception as e:
+                # The order exists; only its workflow failed to start
+                result['status'] = 'created'
+                result['error'] = f"Failed to start workflow: {str(e)}"
+        return result
+    
+    tasks = [
+        asyncio.ensure_future(start(index, order, created, error))
+        for index, (order, created, error) in zip(positions, inserted)
+    ]
+    
+    if not stream:
+        for result in await asyncio.gather(*tasks):
+            results[result['index']] = result
+        return json_response({
+            'results': results,
+            'summary': summarize_bulk_results(results)
+        })
+    
+    # Streaming mode: one NDJSON line per order as soon as its workflow start
+    # completes, followed by a summary line
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/x-ndjson',
+        'Access-Control-Allow-Origin': '*'
+    })
+    await response.prepare(request)
+    for result in results:
+        if result is not None:
+            await response.write(serialization.dumps(result) + b'\n')
+    for task in asyncio.as_completed(tasks):
+        result = await task
+        results[result['index']] = result
+        await response.write(serialization.dumps(result) + b'\n')
+    await response.write(serialization.dumps({'summary': summarize_bulk_results(results)}) + b'\n')
+    await response.write_eof()
+    return response
+
+def summarize_bulk_results(results):
+    summary = {'total': len(results)}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return summary
+
+SSE_HEARTBEAT_SECONDS = 15
+
+async def stream_order_events(request, queue, order_id=None, initial=None):
+    """Stream order status changes from a hub subscription as server-sent events."""
+    hub = request.app['order_events']
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Access-Control-Allow-Origin': '*'
+    })
+    await response.prepare(request)
+    
+    async def send(event):
+        await response.write(b"event: status\ndata: " + serialization.dumps(event) + b"\n\n")
+    
+    try:
+        if initial:
+            await send(initial)
+            if order_id and initial.get('status') in TERMINAL_STATUSES:
+                return response
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing an idle connection
+                await response.write(b": heartbeat\n\n")
+                continue
+            await send(event)
+            if order_id and event.get('status') in TERMINAL_STATUSES:
+                break
+    except (ConnectionResetError, asyncio.CancelledError):
+        # Client went away
+        pass
+    finally:
+        hub.unsubscribe(queue)
+    return response
+
+async def order_events_handler(request):
+    order_id = request.match_info['order_id']
+    hub = request.app['order_events']
+    # Subscribe before reading the current status so no transition is missed
+    queue = hub.subscribe(order_id=order_id)
+    try:
+        order = await orders_repo.get_order_status(order_id)
+    except Exception:
+        hub.unsubscribe(queue)
+        raise
+    if not order:
+        hub.unsubscribe(queue)
+        return json_response({'error': 'Order not found'}, status=404)
+    return await stream_order_events(request, queue, order_id=order_id, initial=order)
+
+async def user_order_events_handler(request):
+    queue = request.app['order_events'].subscribe(user_id=request.match_info['user_id'])
+    return await stream_order_events(request, queue)
+
+async def health_handler(request):
+    loop = asyncio.get_running_loop()
+    mongo = await loop.run_in_executor(get_executor(), mongo_health)
+    status = 200 if mongo['status'] == 'ok' else 503
+    return json_response({'mongodb': mongo}, status=status)
+
 async def simulate_failure(request):
     try:
         data = await request.json()
@@ -228,27 +675,48 @@ async def init_app():
     async def cors_middleware(app, handler):
         async def middleware(request):
             if request.method == 'OPTIONS':
-                return web.Response(
-                    headers={
-                        'Access-Control-Allow-Origin': '*',
-                        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                        'Access-Control-Allow-Headers': 'Content-Type'
-                    }
-                )
+                return web.Response(headers=CORS_HEADERS)
             response = await handler(request)
             return response
         return middleware
 
     app.middlewares.append(cors_middleware)
     
+    # Warn at startup if any of the indexes the hot queries rely on are missing
+    async def verify_indexes(app):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(get_executor(), report_missing_indexes)
+
+    app.on_startup.append(verify_indexes)
+    
+    # Inventory catalog cached per version of the stock it was read at
+    app['inventory_catalog'] = InventoryCatalog(inventory_repo, CatalogVersionsRepository())
+    
+    # One upstream order event subscription shared by all SSE clients
+    app['order_events'] = OrderEventHub()
+    
+    # Release the Mongo executor threads and connection pool on shutdown
+    async def cleanup_mongo(app):
+        app['order_events'].stop()
+        shutdown_executor()
+        close_client()
+
+    app.on_cleanup.append(cleanup_mongo)
+    
     # Add routes
     app.router.add_get('/', index)
     app.router.add_get('/inventory', get_inventory_handler)
     app.router.add_get('/orders', get_orders_handler)
+    app.router.add_get('/orders/export', export_orders_handler)
     app.router.add_get('/rewards', get_rewards_handler)
     app.router.add_get('/balance', get_balance_handler)
+    app.router.add_get('/balance/transactions', get_balance_transactions_handler)
     app.router.add_post('/order', place_order)
+    app.router.add_post('/orders/bulk', place_bulk_orders)
+    app.router.add_get('/orders/{order_id}/events', order_events_handler)
+    app.router.add_get('/users/{user_id}/orders/events', user_order_events_handler)
     app.router.add_post('/simulate_failure', simulate_failure)
+    app.router.add_get('/health', health_handler)
     
     return app
 
@@ -0,0 +1,298 @@
+"""
+End-to-end load test of the order pipeline.
+
+Places orders through POST /order (--mode http, needs app.py running) or by
+inserting the order and starting OrderProcessingWorkflow directly
+(--mode direct), at a fixed concurrency, then waits for the orders to finish
+and reports:
+
+- submission rate and request latency
+- completed orders/sec
+- per-stage latency percentiles from the orders' `*_at` timestamps
+- event counts and sizes of a sample of workflow histories
+- MongoDB opcounters during the run
+
+Results are written as JSON for comparing runs. Run it against a local
+Temporal dev server, a local mongod and at least one worker, preferably with
+SIMULATION_PROFILE=zero so it measures the system rather than simulated sleeps:
+
+    python -m bench.load_test --orders 1000 --concurrency 50 --prepare
+    python -m bench.load_test --mode direct --orders 1000 --baseline bench_results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+from storage.connection import get_database
+from storage.catalog import bump_catalog_version
+from storage.order_events import TERMINAL_STATUSES
+from temporal_client import get_temporal_client
+from bench.stats import percentiles
+
+# (name, from timestamp, to timestamp) of each reported stage
+STAGES = [
+    ('queued', 'created_at', 'processing_at'),
+    ('payment', 'processing_at', 'payment_processed_at'),
+    ('inventory', 'payment_processed_at', 'inventory_reserved_at'),
+    ('shipping', 'shipping_at', 'shipped_at'),
+    ('rewards', 'shipped_at', 'rewards_added_at'),
+    ('end_to_end', 'created_at', 'completed_at')
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the order pipeline")
+    parser.add_argument('--mode', choices=['http', 'direct'], default='http',
+                        help="Place orders through POST /order or start workflows directly")
+    parser.add_argument('--url', default=os.getenv('BENCH_URL', 'http://localhost:5000'),
+                        help="Base URL of app.py in http mode")
+    parser.add_argument('--orders', type=int, default=200, help="Number of orders to place")
+    parser.add_argument('--concurrency', type=int, default=20, help="Orders placed at once")
+    parser.add_argument('--items-per-order', type=int, default=1, help="Distinct SKUs per order")
+    parser.add_argument('--user-id', default='default_user',
+                        help="User placing orders in direct mode (http mode always uses default_user)")
+    parser.add_argument('--timeout', type=float, default=300, help="Seconds to wait for orders to finish")
+    parser.add_argument('--history-sample', type=int, default=20,
+                        help="Number of workflow histories to fetch and measure")
+    parser.add_argument('--prepare', action='store_true',
+                        help="Raise stock and the user's balance so the run is not limited by them")
+    parser.add_argument('--output', default='bench_results.json', help="Results file")
+    parser.add_argument('--baseline', help="Earlier results file to compare against")
+    return parser.parse_args()
+
+
+def prepare(db, user_id: str):
+    # $max only ever raises the values, so repeated runs leave them alone
+    db.inventory.update_many({}, {'$max': {'stock': 10 ** 9}})
+    bump_catalog_version(db=db)
+    db.balances.update_one({'user_id': user_id}, {'$max': {'balance': 10.0 ** 12}}, upsert=True)
+
+
+def order_items(products: list, index: int, items_per_order: int) -> list:
+    """Pick items_per_order SKUs for the index-th order, rotating through the catalog."""
+    count = min(items_per_order, len(products))
+    return [
+        {
+            'sku': product['sku'],
+            'name': product['name'],
+            'price': product['price'],
+            'quantity': 1
+        }
+        for product in (products[(index + offset) % len(products)] for offset in range(count))
+    ]
+
+
+async def place_orders(args, products: list) -> list:
+    """
+    Place args.orders orders with at most args.concurrency in flight.
+
+    Returns:
+        list: One {'order_id', 'latency_ms', 'error'} per order
+    """
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    if args.mode == 'http':
+        import aiohttp
+        session = aiohttp.ClientSession()
+
+        async def submit(items):
+            async with session.post(f"{args.url}/order", json={'items': items}) as response:
+                body = await response.json()
+                if response.status >= 400:
+                    raise Exception(f"HTTP {response.status}: {body.get('error')}")
+                return body['order_id']
+    else:
+        # Same order document and workflow start as POST /order
+        from app import build_order, start_order_workflow
+        from storage.repositories import OrdersRepository
+        session = None
+        client = await get_temporal_client()
+        orders_repo = OrdersRepository()
+
+        async def submit(items):
+            order, _ = await orders_repo.insert_order(build_order(items, args.user_id))
+            await start_order_workflow(client, order)
+            return order['order_id']
+
+    async def place(index):
+        async with semaphore:
+            started = time.perf_counter()
+            result = {'order_id': None, 'error': None}
+            try:
+                result['order_id'] = await submit(order_items(products, index, args.items_per_order))
+            except Exception as e:
+                result['error'] = str(e)
+            result['latency_ms'] = (time.perf_counter() - started) * 1000
+            return result
+
+    try:
+        return await asyncio.gather(*(place(index) for index in range(args.orders)))
+    finally:
+        if session is not None:
+            await session.close()
+
+
+async def wait_for_orders(db, order_ids: list, timeout: float) -> int:
+    """Poll until every order is completed or failed. Returns how many still are not."""
+    deadline = time.monotonic() + timeout
+    pending = len(order_ids)
+    while pending and time.monotonic() < deadline:
+        finished = db.orders.count_documents({
+            'order_id': {'$in': order_ids},
+            'status': {'$in': list(TERMINAL_STATUSES)}
+        })
+        pending = len(order_ids) - finished
+        print(f"  {finished}/{len(order_ids)} orders finished")
+        if pending:
+            await asyncio.sleep(1)
+    return pending
+
+
+def stage_latencies(orders: list) -> dict:
+    latencies = {name: [] for name, _, _ in STAGES}
+    for order in orders:
+        for name, start_field, end_field in STAGES:
+            if order.get(start_field) and order.get(end_field):
+                latencies[name].append((order[end_field] - order[start_field]).total_seconds() * 1000)
+    return {name: percentiles(values) for name, values in latencies.items()}
+
+
+def throughput(orders: list) -> float:
+    """Completed orders per second between the first order created and the last completed."""
+    completed = [order for order in orders if order.get('completed_at')]
+    if not completed:
+        return 0.0
+    started = min(order['created_at'] for order in orders)
+    finished = max(order['completed_at'] for order in completed)
+    elapsed = (finished - started).total_seconds()
+    return round(len(completed) / elapsed, 2) if elapsed > 0 else 0.0
+
+
+async def history_sizes(order_ids: list) -> dict:
+    """Event counts and encoded sizes of the given orders' workflow histories."""
+    client = await get_temporal_client()
+    events = []
+    sizes = []
+    for order_id in order_ids:
+        try:
+            history = await client.get_workflow_handle(f"order_{order_id}").fetch_history()
+        except Exception as e:
+            print(f"  Could not fetch history of order_{order_id}: {str(e)}")
+            continue
+        events.append(len(history.events))
+        sizes.append(sum(event.ByteSize() for event in history.events))
+    return {'events': percentiles(events), 'bytes': percentiles(sizes)}
+
+
+def opcounters(db) -> dict:
+    try:
+        return dict(db.command('serverStatus')['opcounters'])
+    except Exception as e:
+        print(f"  Could not read MongoDB opcounters: {str(e)}")
+        return {}
+
+
+def compare(results: dict, baseline: dict):
+    """Print the change of the headline numbers against an earlier run."""
+    def change(label, current, previous):
+        if current is None or not previous:
+            return
+        print(f"  {label}: {previous} -> {current} ({(current - previous) / previous * 100:+.1f}%)")
+
+    print("\nCompared with baseline:")
+    change("completed orders/sec", results['throughput_orders_per_sec'], baseline.get('throughput_orders_per_sec'))
+    for name, _, _ in STAGES:
+        current = results['stages_ms'].get(name, {})
+        previous = baseline.get('stages_ms', {}).get(name, {})
+        change(f"{name} p50 ms", current.get('p50'), previous.get('p50'))
+        change(f"{name} p99 ms", current.get('p99'), previous.get('p99'))
+    change("history events p50", results['history']['events'].get('p50'),
+           baseline.get('history', {}).get('events', {}).get('p50'))
+
+
+async def main(args):
+    # Read before the run, --baseline may name the same file as --output
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    db = get_database()
+    if args.prepare:
+        prepare(db, 'default_user' if args.mode == 'http' else args.user_id)
+    products = list(db.inventory.find({}, {'_id': 0, 'sku': 1, 'name': 1, 'price': 1}).sort('sku', 1))
+    if not products:
+        print("The inventory is empty; run init_db.py first")
+        return 1
+
+    print(f"Placing {args.orders} orders ({args.mode}, concurrency {args.concurrency})...")
+    ops_before = opcounters(db)
+    started = time.perf_counter()
+    placed = await place_orders(args, products)
+    submit_seconds = time.perf_counter() - started
+    order_ids = [result['order_id'] for result in placed if result['order_id']]
+    errors = [result['error'] for result in placed if result['error']]
+
+    print(f"Waiting up to {args.timeout:.0f}s for {len(order_ids)} orders to finish...")
+    pending = await wait_for_orders(db, order_ids, args.timeout)
+    ops_after = opcounters(db)
+
+    orders = list(db.orders.find(
+        {'order_id': {'$in': order_ids}},
+        {'_id': 0, 'order_id': 1, 'status': 1, **{field: 1 for _, start, end in STAGES for field in (start, end)}}
+    ))
+    statuses = {}
+    for order in orders:
+        statuses[order['status']] = statuses.get(order['status'], 0) + 1
+
+    print(f"Fetching {min(args.history_sample, len(order_ids))} workflow histories...")
+    results = {
+        'run_at': datetime.utcnow().isoformat(),
+        'config': {
+            'mode': args.mode,
+            'orders': args.orders,
+            'concurrency': args.concurrency,
+            'items_per_order': args.items_per_order,
+            'simulation_profile': os.getenv('SIMULATION_PROFILE', 'demo'),
+            'shipping_mode': os.getenv('SHIPPING_MODE', 'parcel')
+        },
+        'submitted': len(order_ids),
+        'submit_errors': len(errors),
+        'submit_error_samples': sorted(set(errors))[:5],
+        'submit_orders_per_sec': round(len(order_ids) / submit_seconds, 2) if submit_seconds else 0.0,
+        'request_latency_ms': percentiles([result['latency_ms'] for result in placed]),
+        'statuses': statuses,
+        'unfinished': pending,
+        'throughput_orders_per_sec': throughput(orders),
+        'stages_ms': stage_latencies(orders),
+        'history': await history_sizes(order_ids[:args.history_sample]),
+        'mongo_opcounters': {
+            op: ops_after[op] - ops_before.get(op, 0) for op in ops_after
+        }
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\nSubmitted {results['submitted']} orders at {results['submit_orders_per_sec']}/s "
+          f"({results['submit_errors']} errors), statuses: {statuses}")
+    print(f"Completed orders/sec: {results['throughput_orders_per_sec']}")
+    for name, stats in results['stages_ms'].items():
+        if stats['count']:
+            print(f"  {name:<11} p50={stats['p50']}ms p90={stats['p90']}ms p99={stats['p99']}ms max={stats['max']}ms")
+    print(f"History events: {results['history']['events']}")
+    print(f"MongoDB ops: {results['mongo_opcounters']}")
+    print(f"Results written to {args.output}")
+
+    if baseline:
+        compare(results, baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,176 @@
+"""
+Replay benchmark and determinism check for the workflows.
+
+Capture histories from a Temporal server (e.g. after a load test run) into a
+directory of JSON files, one per workflow run:
+
+    python -m bench.replay capture --limit 200
+    python -m bench.replay capture --query "WorkflowType='CustomerRewardsWorkflow'"
+
+Histories exported by other means (`temporal workflow show --output json`) can
+be dropped into the same directory. Then replay them against the current
+workflow code:
+
+    python -m bench.replay run --iterations 5 --baseline replay_results.json
+
+`run` reports CPU and wall time per replay by workflow type and lists every
+history that no longer replays (nondeterminism), exiting with status 1 if there
+are any so it can gate a deploy. Results are written as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+from temporalio.client import WorkflowHistory
+from temporalio.worker import Replayer
+from workflows.order_workflow import OrderProcessingWorkflow
+from workflows.rewards_workflow import CustomerRewardsWorkflow
+from workflows.shipping_workflow import ShippingWorkflow, ParcelShippingWorkflow
+from temporal_client import get_temporal_client
+from bench.stats import percentiles
+
+WORKFLOWS = [OrderProcessingWorkflow, CustomerRewardsWorkflow, ShippingWorkflow, ParcelShippingWorkflow]
+
+DEFAULT_QUERY = "WorkflowType='OrderProcessingWorkflow' OR WorkflowType='CustomerRewardsWorkflow'"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Capture and replay workflow histories")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    capture = subparsers.add_parser('capture', help="Save workflow histories from the Temporal server")
+    capture.add_argument('--query', default=DEFAULT_QUERY, help="Visibility query selecting the workflows")
+    capture.add_argument('--limit', type=int, default=100, help="Maximum number of histories to save")
+    capture.add_argument('--dir', default='replay_histories', help="Directory to write the histories to")
+
+    run = subparsers.add_parser('run', help="Replay saved histories against the current workflow code")
+    run.add_argument('--dir', default='replay_histories', help="Directory of history JSON files")
+    run.add_argument('--iterations', type=int, default=3, help="Replays of each history, for stable timings")
+    run.add_argument('--output', default='replay_results.json', help="Results file")
+    run.add_argument('--baseline', help="Earlier results file to compare against")
+    return parser.parse_args()
+
+
+def workflow_type(history: WorkflowHistory) -> str:
+    started = history.events[0].workflow_execution_started_event_attributes
+    return started.workflow_type.name
+
+
+async def capture(args) -> int:
+    client = await get_temporal_client()
+    os.makedirs(args.dir, exist_ok=True)
+    saved = 0
+    async for execution in client.list_workflows(args.query):
+        if saved >= args.limit:
+            break
+        handle = client.get_workflow_handle(execution.id, run_id=execution.run_id)
+        try:
+            history = await handle.fetch_history()
+        except Exception as e:
+            print(f"Could not fetch history of {execution.id}: {str(e)}")
+            continue
+        filename = f"{execution.id}_{execution.run_id}.json".replace(os.sep, '_')
+        with open(os.path.join(args.dir, filename), 'w') as f:
+            f.write(history.to_json())
+        saved += 1
+    print(f"Saved {saved} histories to {args.dir}")
+    return 0
+
+
+def load_histories(directory: str) -> list:
+    histories = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(directory, filename)) as f:
+            # The workflow id only labels the history; use the file name
+            histories.append(WorkflowHistory.from_json(filename[:-len('.json')], f.read()))
+    return histories
+
+
+async def replay(args) -> int:
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    histories = load_histories(args.dir)
+    if not histories:
+        print(f"No histories in {args.dir}; run `python -m bench.replay capture` first")
+        return 1
+
+    replayer = Replayer(workflows=WORKFLOWS)
+    by_type = {}
+    failures = []
+    for history in histories:
+        name = workflow_type(history)
+        stats = by_type.setdefault(name, {'histories': 0, 'events': [], 'cpu_ms': [], 'wall_ms': []})
+        stats['histories'] += 1
+        stats['events'].append(len(history.events))
+        for _ in range(args.iterations):
+            # process_time counts the CPU of every thread, including the SDK core
+            cpu_started = time.process_time()
+            wall_started = time.perf_counter()
+            result = await replayer.replay_workflow(history, raise_on_replay_failure=False)
+            stats['cpu_ms'].append((time.process_time() - cpu_started) * 1000)
+            stats['wall_ms'].append((time.perf_counter() - wall_started) * 1000)
+            if result.replay_failure is not None:
+                failures.append({
+                    'workflow_id': history.workflow_id,
+                    'workflow_type': name,
+                    'error': str(result.replay_failure)
+                })
+                break
+
+    results = {
+        'run_at': datetime.utcnow().isoformat(),
+        'histories': len(histories),
+        'iterations': args.iterations,
+        'workflows': {
+            name: {
+                'histories': stats['histories'],
+                'events': percentiles(stats['events'], digits=2),
+                'cpu_ms': percentiles(stats['cpu_ms'], digits=2),
+                'wall_ms': percentiles(stats['wall_ms'], digits=2),
+                # Replay cost normalised by history length
+                'cpu_ms_per_1k_events': round(
+                    sum(stats['cpu_ms']) / len(stats['cpu_ms']) * 1000 / max(sum(stats['events']) / len(stats['events']), 1),
+                    2
+                )
+            }
+            for name, stats in by_type.items()
+        },
+        'nondeterministic': failures
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for name, stats in results['workflows'].items():
+        print(f"{name}: {stats['histories']} histories, events p50={stats['events']['p50']}, "
+              f"replay cpu p50={stats['cpu_ms']['p50']}ms p90={stats['cpu_ms']['p90']}ms, "
+              f"{stats['cpu_ms_per_1k_events']}ms CPU per 1k events")
+        previous = (baseline or {}).get('workflows', {}).get(name)
+        if previous and previous['cpu_ms'].get('p50'):
+            change = (stats['cpu_ms']['p50'] - previous['cpu_ms']['p50']) / previous['cpu_ms']['p50'] * 100
+            print(f"  replay cpu p50 vs baseline: {previous['cpu_ms']['p50']}ms -> {stats['cpu_ms']['p50']}ms ({change:+.1f}%)")
+    for failure in failures:
+        print(f"NONDETERMINISM in {failure['workflow_id']} ({failure['workflow_type']}): {failure['error']}")
+    print(f"Results written to {args.output}")
+    return 1 if failures else 0
+
+
+def main():
+    args = parse_args()
+    if args.command == 'capture':
+        return asyncio.run(capture(args))
+    return asyncio.run(replay(args))
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    sys.exit(main())
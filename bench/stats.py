@@ -0,0 +1,29 @@
+"""Summary statistics shared by the benchmarks."""
+import math
+
+
+def percentiles(values: list, digits: int = 1) -> dict:
+    """
+    Nearest-rank percentiles of values.
+
+    Args:
+        values: Measurements, in any order
+        digits: Decimal places the results are rounded to
+
+    Returns:
+        dict: 'count', and 'p50', 'p90', 'p99' and 'max' when there are values
+    """
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def rank(p):
+        return round(values[max(math.ceil(p / 100 * len(values)) - 1, 0)], digits)
+
+    return {
+        'count': len(values),
+        'p50': rank(50),
+        'p90': rank(90),
+        'p99': rank(99),
+        'max': round(values[-1], digits)
+    }
@@ -1,9 +1,12 @@
-from pymongo import MongoClient
 from datetime import datetime
+from dotenv import load_dotenv
+from storage.connection import get_database
+from storage.indexes import ensure_indexes
+from storage.catalog import bump_catalog_version
 
 # Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017/')
-db = client['ecommerce_db']
+load_dotenv()
+db = get_database()
 
 print("\nStarting database initialization...")
 
@@ -52,32 +55,43 @@ print("\nClearing existing collections...")
 # Clear existing data
 db.inventory.delete_many({})
 print("- Cleared inventory collection")
+db.inventory_reservations.delete_many({})
+print("- Cleared inventory reservations collection")
 db.balances.delete_many({})
 print("- Cleared balances collection")
 db.orders.delete_many({})
 print("- Cleared orders collection")
 db.rewards.delete_many({})
 print("- Cleared rewards collection")
+db.balance_ledger.delete_many({})
+print("- Cleared balance ledger collection")
 
 print("\nInitializing collections...")
 
+# Create indexes (no-op for the ones that already exist)
+for collection_name, names in ensure_indexes(db).items():
+    print(f"- Created indexes on {collection_name}: {', '.join(names)}")
+
 # Insert sample products
 db.inventory.insert_many(products)
+bump_catalog_version(db=db)
 print("- Added sample products")
 
 # Initialize default user balance
+initial_deposit = {
+    'amount': 2000.0,
+    'type': 'initial_deposit',
+    'timestamp': datetime.now()
+}
 default_balance = {
     'user_id': 'default_user',
     'balance': 2000.0,
     'created_at': datetime.now(),
     'updated_at': datetime.now(),
-    'transactions': [{
-        'amount': 2000.0,
-        'type': 'initial_deposit',
-        'timestamp': datetime.now()
-    }]
+    'recent_transactions': [initial_deposit]
 }
 result = db.balances.insert_one(default_balance)
+db.balance_ledger.insert_one(dict(initial_deposit, user_id='default_user', balance_after=2000.0))
 print("- Added default user balance")
 
 # Verify initialization
@@ -0,0 +1,127 @@
+"""
+JSON encoding for HTTP responses and streams.
+
+Uses orjson when it is installed, which encodes datetimes natively and is
+several times faster than the stdlib encoder, and falls back to the stdlib
+json module otherwise. Both paths produce the same output: compact JSON as
+UTF-8 bytes, datetimes as ISO 8601 strings and ObjectIds as hex strings.
+
+Response bodies can additionally be compressed with gzip, or brotli when the
+brotli package is installed.
+"""
+import gzip
+import json
+import os
+from datetime import date, datetime
+from bson import Decimal128, ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed; 0 disables compression
+COMPRESSION_MIN_BYTES = int(os.getenv('JSON_COMPRESSION_MIN_BYTES', '4096'))
+
+
+def _default(obj):
+    # Types neither encoder handles on its own. orjson only calls this for
+    # ObjectId and Decimal128; the stdlib encoder also needs datetimes.
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal128):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(obj) -> bytes:
+        """Encode obj as compact UTF-8 JSON."""
+        return orjson.dumps(obj, default=_default)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(default=_default, separators=(',', ':'), ensure_ascii=False)
+
+    def dumps(obj) -> bytes:
+        """Encode obj as compact UTF-8 JSON."""
+        return _encoder.encode(obj).encode()
+
+    loads = json.loads
+
+
+def dumps_lines(objs) -> bytes:
+    """Encode an iterable of objects as newline-delimited JSON."""
+    return b''.join(dumps(obj) + b'\n' for obj in objs)
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Content codings a client accepts, from its Accept-Encoding header."""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding)
+    return accepted
+
+
+def select_encoding(body: bytes, accept_encoding: str, min_bytes: int = None):
+    """
+    Pick the content coding to send a body with.
+
+    Args:
+        body: Encoded response body
+        accept_encoding: Value of the request's Accept-Encoding header
+        min_bytes: Size threshold, defaults to COMPRESSION_MIN_BYTES
+
+    Returns:
+        str: 'br' or 'gzip', or None when the body should be sent as is because
+        it is small or the client accepts no supported coding
+    """
+    min_bytes = COMPRESSION_MIN_BYTES if min_bytes is None else min_bytes
+    if not min_bytes or len(body) < min_bytes:
+        return None
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def encode_body(body: bytes, encoding: str) -> bytes:
+    """Compress a body with a coding returned by select_encoding."""
+    if encoding == 'br':
+        # Quality 4 is about as fast as gzip while still compressing better
+        return brotli.compress(body, quality=4)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=5)
+    return body
+
+
+def compress(body: bytes, accept_encoding: str, min_bytes: int = None):
+    """
+    Compress a response body with the best coding the client accepts.
+
+    Returns:
+        tuple: (body, content coding), with a coding of None when the body was
+        left as is
+    """
+    encoding = select_encoding(body, accept_encoding, min_bytes)
+    return encode_body(body, encoding), encoding
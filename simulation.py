@@ -0,0 +1,182 @@
+"""
+Latency and failure profile for the simulated parts of the app: payment,
+inventory, carrier and notification calls in activities, and the shipping
+timers in workflows.
+
+A profile is picked with SIMULATION_PROFILE:
+
+    demo       fixed delays and failure rates the app was built with (default)
+    zero       no delays and no injected failures, for throughput benchmarks
+    realistic  log-normally distributed delays and low failure rates
+
+SIMULATION_PROFILE_FILE can point at a JSON file that overrides parts of the
+selected profile, or picks its own base with "base":
+
+    {"base": "realistic",
+     "delays": {"payment": {"distribution": "lognormal", "median": 0.8, "sigma": 0.4, "max": 4}},
+     "failure_rates": {"payment": 0.05}}
+
+A delay is a number of seconds or a distribution: {"distribution": "fixed",
+"seconds": s}, {"distribution": "uniform", "min": a, "max": b},
+{"distribution": "lognormal", "median": m, "sigma": s} or
+{"distribution": "exponential", "mean": m}; any of them can set "max".
+
+Activities sample with the random module. Workflows must not read the
+environment, so the app passes the workflow delays in the workflow arguments
+and workflows sample them with workflow.random(), which replays identically.
+"""
+import json
+import math
+import os
+import random
+import time
+
+# Delays used by workflow timers rather than by activities
+WORKFLOW_DELAYS = ('pickup_wait', 'transit')
+
+PROFILES = {
+    'demo': {
+        'delays': {
+            'payment': 1,
+            'refund': 1,
+            'inventory': 1,
+            'notification': 1,
+            'rewards_update': 0.5,
+            'shipping_label': 1,
+            'pickup': 1,
+            'delivery': 1,
+            'pickup_wait': 2,
+            'transit': 3
+        },
+        'failure_rates': {
+            'payment': 0.2,
+            'inventory': 0.1,
+            'notification': 0.1,
+            'rewards_update': 0.05,
+            'shipping_label': 0.15,
+            'pickup': 0.1,
+            'delivery': 0.05
+        }
+    },
+    'zero': {
+        'delays': {},
+        'failure_rates': {}
+    },
+    'realistic': {
+        # Activity delays stay well below the 5-10s activity timeouts
+        'delays': {
+            'payment': {'distribution': 'lognormal', 'median': 0.4, 'sigma': 0.5, 'max': 4},
+            'refund': {'distribution': 'lognormal', 'median': 0.4, 'sigma': 0.5, 'max': 4},
+            'inventory': {'distribution': 'lognormal', 'median': 0.02, 'sigma': 0.4, 'max': 1},
+            'notification': {'distribution': 'lognormal', 'median': 0.15, 'sigma': 0.6, 'max': 3},
+            'rewards_update': {'distribution': 'lognormal', 'median': 0.02, 'sigma': 0.4, 'max': 1},
+            'shipping_label': {'distribution': 'lognormal', 'median': 0.5, 'sigma': 0.5, 'max': 4},
+            'pickup': {'distribution': 'lognormal', 'median': 0.3, 'sigma': 0.5, 'max': 4},
+            'delivery': {'distribution': 'lognormal', 'median': 0.2, 'sigma': 0.5, 'max': 4},
+            'pickup_wait': {'distribution': 'uniform', 'min': 1, 'max': 5},
+            'transit': {'distribution': 'lognormal', 'median': 3, 'sigma': 0.5, 'max': 20}
+        },
+        'failure_rates': {
+            'payment': 0.02,
+            'inventory': 0.005,
+            'notification': 0.01,
+            'rewards_update': 0.005,
+            'shipping_label': 0.02,
+            'pickup': 0.01,
+            'delivery': 0.005
+        }
+    }
+}
+
+DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal', 'exponential')
+
+# Profile of this process, loaded on first use
+_profile = None
+
+
+def load_profile(name: str = None, path: str = None) -> dict:
+    """
+    Build a profile from a built-in profile and an optional JSON override file.
+
+    Args:
+        name: Built-in profile, defaults to SIMULATION_PROFILE or 'demo'
+        path: Override file, defaults to SIMULATION_PROFILE_FILE
+
+    Returns:
+        dict: Profile with 'name', 'delays' and 'failure_rates'
+    """
+    path = path or os.getenv('SIMULATION_PROFILE_FILE')
+    overrides = {}
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+    name = overrides.get('base') or name or os.getenv('SIMULATION_PROFILE', 'demo')
+    if name not in PROFILES:
+        raise ValueError(f"Unknown simulation profile {name!r}, expected one of {', '.join(PROFILES)}")
+
+    profile = {
+        'name': f"{name}+{os.path.basename(path)}" if path else name,
+        'delays': dict(PROFILES[name]['delays'], **overrides.get('delays', {})),
+        'failure_rates': dict(PROFILES[name]['failure_rates'], **overrides.get('failure_rates', {}))
+    }
+    for spec in profile['delays'].values():
+        # Fail at startup rather than on the first sampled call
+        sample_delay(spec)
+    return profile
+
+
+def get_profile() -> dict:
+    """Return this process's profile, loading it on first call."""
+    global _profile
+    if _profile is None:
+        _profile = load_profile()
+    return _profile
+
+
+def sample_delay(spec, rng=random) -> float:
+    """
+    Draw a delay in seconds from a delay spec.
+
+    Args:
+        spec: Seconds, a distribution dict, or None for no delay
+        rng: Source of randomness; workflows pass workflow.random()
+
+    Returns:
+        float: Seconds to wait, never negative
+    """
+    if not spec:
+        return 0.0
+    if isinstance(spec, (int, float)):
+        return max(float(spec), 0.0)
+
+    distribution = spec.get('distribution', 'fixed')
+    if distribution == 'fixed':
+        seconds = spec.get('seconds', 0)
+    elif distribution == 'uniform':
+        seconds = rng.uniform(spec['min'], spec['max'])
+    elif distribution == 'lognormal':
+        seconds = spec['median'] * math.exp(rng.gauss(0, spec.get('sigma', 0.5)))
+    elif distribution == 'exponential':
+        seconds = rng.expovariate(1 / spec['mean']) if spec['mean'] > 0 else 0
+    else:
+        raise ValueError(f"Unknown delay distribution {distribution!r}, expected one of {', '.join(DISTRIBUTIONS)}")
+    return min(max(float(seconds), 0.0), spec.get('max', math.inf))
+
+
+def simulate_delay(name: str):
+    """Block for the profile's delay for name (activities only)."""
+    seconds = sample_delay(get_profile()['delays'].get(name))
+    if seconds:
+        time.sleep(seconds)
+
+
+def maybe_fail(name: str, message: str):
+    """Raise Exception(message) with the profile's failure rate for name (activities only)."""
+    if random.random() < get_profile()['failure_rates'].get(name, 0):
+        raise Exception(message)
+
+
+def workflow_delays() -> dict:
+    """Delay specs to pass to workflows, which cannot read the profile themselves."""
+    delays = get_profile()['delays']
+    return {name: delays.get(name, 0) for name in WORKFLOW_DELAYS}
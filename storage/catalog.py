@@ -0,0 +1,130 @@
+"""
+Versioned in-process cache of the inventory catalog served by GET /inventory.
+
+Every write that changes stock bumps a counter in the catalog_versions
+collection. The web app keeps the encoded catalog for the version it last
+loaded and re-reads that counter at most every INVENTORY_VERSION_TTL seconds,
+so catalog reads almost never reach Mongo and a stock change is visible to
+clients within that interval.
+"""
+import asyncio
+import hashlib
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import serialization
+from storage.connection import get_database
+from storage.cache import TTLCache
+
+INVENTORY_CATALOG = 'inventory'
+
+
+def bump_catalog_version(name: str = INVENTORY_CATALOG, db=None):
+    """
+    Mark a catalog as changed. Call after the write that changed it, so a
+    reader that sees the new version also sees the write.
+
+    Args:
+        name: Catalog whose version is bumped
+        db: Database to update, defaults to the shared application database
+    """
+    db = db if db is not None else get_database()
+    db.catalog_versions.update_one(
+        {'_id': name},
+        {'$inc': {'version': 1}, '$currentDate': {'updated_at': True}},
+        upsert=True
+    )
+
+
+@dataclass
+class CatalogSnapshot:
+    """One version of the catalog, encoded once and shared by every request."""
+
+    version: int
+    body: bytes
+    etag: str
+    last_modified: datetime = None
+    encoded: dict = field(default_factory=dict)
+
+    def encode(self, encoding: str) -> bytes:
+        """Return the body compressed with encoding, compressing once per coding."""
+        if encoding not in self.encoded:
+            self.encoded[encoding] = serialization.encode_body(self.body, encoding)
+        return self.encoded[encoding]
+
+    def etag_for(self, encoding: str) -> str:
+        # Each coding is a different byte sequence, so it gets its own strong ETag
+        return f"{self.etag}-{encoding}" if encoding else self.etag
+
+    def not_modified(self, if_none_match, if_modified_since) -> bool:
+        """
+        Evaluate a conditional GET against this snapshot.
+
+        Args:
+            if_none_match: Parsed If-None-Match header (aiohttp ETag tuple) or None
+            if_modified_since: Parsed If-Modified-Since header or None
+
+        Returns:
+            bool: True if the client's copy is current and a 304 can be sent
+        """
+        if if_none_match:
+            # Any coding of the same content is still current
+            return any(
+                tag.value == '*' or tag.value == self.etag or tag.value.startswith(f"{self.etag}-")
+                for tag in if_none_match
+            )
+        if if_modified_since and self.last_modified:
+            return self.last_modified <= if_modified_since
+        return False
+
+
+class InventoryCatalog:
+    """
+    Serve the inventory catalog from memory, reloading it only when its
+    version changes.
+
+    Only used from the web app's event loop. Concurrent requests that find the
+    version changed wait on one reload instead of each reading the collection.
+    """
+
+    def __init__(self, inventory_repo, versions_repo, version_ttl: float = None):
+        if version_ttl is None:
+            version_ttl = float(os.getenv('INVENTORY_VERSION_TTL', '1'))
+        self.inventory_repo = inventory_repo
+        self.versions_repo = versions_repo
+        self._versions = TTLCache(version_ttl, max_entries=1)
+        self._snapshot = None
+        self._lock = None
+
+    async def get(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        version = self._versions.get(INVENTORY_CATALOG)
+        if snapshot is not None and version is not None and version['version'] == snapshot.version:
+            return snapshot
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another request may have refreshed while this one waited
+            version = self._versions.get(INVENTORY_CATALOG)
+            if version is None:
+                version = await self.versions_repo.get_version(INVENTORY_CATALOG) or {'version': 0}
+                self._versions.set(INVENTORY_CATALOG, version)
+            if self._snapshot is None or self._snapshot.version != version['version']:
+                items = await self.inventory_repo.list_items()
+                self._snapshot = self._build(items, version)
+            return self._snapshot
+
+    @staticmethod
+    def _build(items: list, version: dict) -> CatalogSnapshot:
+        body = serialization.dumps(items)
+        last_modified = version.get('updated_at')
+        if last_modified is not None:
+            # HTTP dates have second precision; pymongo returns naive UTC
+            last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+        return CatalogSnapshot(
+            version=version['version'],
+            body=body,
+            etag=hashlib.sha1(body).hexdigest(),
+            last_modified=last_modified
+        )
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from pymongo import MongoClient, ReadPreference
+from pymongo.write_concern import WriteConcern
+
+# One MongoClient (and therefore one connection pool) per process, shared by
+# the web app, the worker's activities and the maintenance scripts. It is
+# created on first use so importing a module never opens connections.
+_client = None
+_database = None
+_client_lock = threading.Lock()
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST
+}
+
+
+def _int_env(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def get_settings() -> dict:
+    """Read the connection settings from the environment."""
+    return {
+        'uri': os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'),
+        'database': os.getenv('MONGODB_DATABASE', 'ecommerce_db'),
+        'max_pool_size': _int_env('MONGODB_MAX_POOL_SIZE', 100),
+        'min_pool_size': _int_env('MONGODB_MIN_POOL_SIZE', 0),
+        'connect_timeout_ms': _int_env('MONGODB_CONNECT_TIMEOUT_MS', 5000),
+        'server_selection_timeout_ms': _int_env('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        'socket_timeout_ms': _int_env('MONGODB_SOCKET_TIMEOUT_MS', 0) or None,
+        'write_concern': os.getenv('MONGODB_WRITE_CONCERN', '1'),
+        'read_preference': os.getenv('MONGODB_READ_PREFERENCE', 'primary')
+    }
+
+
+def get_client() -> MongoClient:
+    """Return the shared MongoClient, creating it on first call."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                settings = get_settings()
+                _client = MongoClient(
+                    settings['uri'],
+                    maxPoolSize=settings['max_pool_size'],
+                    minPoolSize=settings['min_pool_size'],
+                    connectTimeoutMS=settings['connect_timeout_ms'],
+                    serverSelectionTimeoutMS=settings['server_selection_timeout_ms'],
+                    socketTimeoutMS=settings['socket_timeout_ms']
+                )
+    return _client
+
+
+def get_database():
+    """Return the application database with the configured write concern and read preference."""
+    global _database
+    if _database is not None:
+        return _database
+    settings = get_settings()
+    w = settings['write_concern']
+    write_concern = WriteConcern(w=int(w) if w.isdigit() else w)
+    read_preference = READ_PREFERENCES.get(settings['read_preference'])
+    if read_preference is None:
+        raise ValueError(f"Unknown MONGODB_READ_PREFERENCE: {settings['read_preference']}")
+    _database = get_client().get_database(
+        settings['database'],
+        write_concern=write_concern,
+        read_preference=read_preference
+    )
+    return _database
+
+
+def get_collection(name: str):
+    """Return a collection from the application database."""
+    return get_database()[name]
+
+
+def health() -> dict:
+    """
+    Ping the server and report connection pool settings.
+
+    Returns:
+        dict: Health report with 'status' set to 'ok' or 'error'
+    """
+    settings = get_settings()
+    report = {
+        'database': settings['database'],
+        'max_pool_size': settings['max_pool_size'],
+        'min_pool_size': settings['min_pool_size'],
+        'write_concern': settings['write_concern'],
+        'read_preference': settings['read_preference']
+    }
+    try:
+        started = time.perf_counter()
+        get_client().admin.command('ping')
+        report['status'] = 'ok'
+        report['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    except Exception as e:
+        report['status'] = 'error'
+        report['error'] = str(e)
+    return report
+
+
+def close_client():
+    """Close the shared client (called on application shutdown)."""
+    global _client, _database
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+            _database = None
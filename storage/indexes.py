@@ -0,0 +1,151 @@
+"""
+Index definitions for the ecommerce_db collections.
+
+Run as a command to create any missing indexes (idempotent) or, with --check,
+to only report what is missing:
+
+    python -m storage.indexes
+    python -m storage.indexes --check
+"""
+import argparse
+import sys
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from storage.connection import get_database
+
+# Indexes use MongoDB's default names (e.g. "sku_1") so ones created by hand
+# are recognised as present.
+INDEXES = {
+    'orders': [
+        # Every status update looks orders up by order_id. The partial filter
+        # tolerates legacy orders written before order_id was set on insert.
+        IndexModel(
+            [('order_id', ASCENDING)],
+            unique=True,
+            partialFilterExpression={'order_id': {'$type': 'string'}}
+        ),
+        # Deduplicates POST /order retries that send an Idempotency-Key
+        IndexModel(
+            [('idempotency_key', ASCENDING)],
+            unique=True,
+            partialFilterExpression={'idempotency_key': {'$type': 'string'}}
+        ),
+        # Keyset pagination and export of GET /orders
+        IndexModel(
+            [('created_at', DESCENDING), ('order_id', DESCENDING)]
+        ),
+        # Polling fallback of the order event stream
+        IndexModel([('updated_at', DESCENDING)]),
+        # Status-filtered listing
+        IndexModel(
+            [('status', ASCENDING), ('created_at', DESCENDING), ('order_id', DESCENDING)]
+        )
+    ],
+    'inventory': [
+        IndexModel([('sku', ASCENDING)], unique=True)
+    ],
+    'inventory_reservations': [
+        # One reservation per SKU of an order; also serves lookups by order_id
+        IndexModel([('order_id', ASCENDING), ('sku', ASCENDING)], unique=True)
+    ],
+    'balances': [
+        IndexModel([('user_id', ASCENDING)], unique=True)
+    ],
+    'balance_ledger': [
+        # Paginated GET /balance/transactions
+        IndexModel([('user_id', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)]),
+        # Idempotency key for debits and credits made on behalf of an order
+        IndexModel(
+            [('reference', ASCENDING)],
+            unique=True,
+            partialFilterExpression={'reference': {'$type': 'string'}}
+        )
+    ],
+    'rewards': [
+        IndexModel([('user_id', ASCENDING)], unique=True)
+    ]
+}
+
+
+def missing_indexes(db=None) -> dict:
+    """
+    Compare the indexes that exist against INDEXES.
+
+    Args:
+        db: Database to inspect, defaults to the shared application database
+
+    Returns:
+        dict: Collection name -> list of missing index names (empty if none)
+    """
+    db = db if db is not None else get_database()
+    missing = {}
+    for collection_name, models in INDEXES.items():
+        existing = db[collection_name].index_information()
+        names = [model.document['name'] for model in models if model.document['name'] not in existing]
+        if names:
+            missing[collection_name] = names
+    return missing
+
+
+def ensure_indexes(db=None) -> dict:
+    """
+    Create every index in INDEXES. Safe to run repeatedly.
+
+    Args:
+        db: Database to update, defaults to the shared application database
+
+    Returns:
+        dict: Collection name -> list of index names that were created
+    """
+    db = db if db is not None else get_database()
+    created = {}
+    for collection_name, names in missing_indexes(db).items():
+        models = [model for model in INDEXES[collection_name] if model.document['name'] in names]
+        created[collection_name] = db[collection_name].create_indexes(models)
+    return created
+
+
+def report_missing_indexes(db=None) -> bool:
+    """
+    Print a warning for each missing index. Used by the app and worker at startup.
+
+    Returns:
+        bool: True if all indexes are present
+    """
+    try:
+        missing = missing_indexes(db)
+    except Exception as e:
+        print(f"WARNING: Could not verify MongoDB indexes: {str(e)}")
+        return False
+    for collection_name, names in missing.items():
+        print(f"WARNING: Missing indexes on {collection_name}: {', '.join(names)}")
+    if missing:
+        print("Run `python -m storage.indexes` to create them")
+    return not missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or verify MongoDB indexes")
+    parser.add_argument('--check', action='store_true', help="Only report missing indexes")
+    args = parser.parse_args()
+
+    if args.check:
+        missing = missing_indexes()
+        if not missing:
+            print("All indexes present")
+            return 0
+        for collection_name, names in missing.items():
+            print(f"- {collection_name}: missing {', '.join(names)}")
+        return 1
+
+    created = ensure_indexes()
+    if not created:
+        print("All indexes already present")
+    for collection_name, names in created.items():
+        print(f"- {collection_name}: created {', '.join(names)}")
+    return 0
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    sys.exit(main())
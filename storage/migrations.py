@@ -0,0 +1,212 @@
+"""
+Data migrations for the ecommerce_db collections. Every migration is
+idempotent, so it is safe to re-run one that was interrupted:
+
+    python -m storage.migrations balance-ledger
+    python -m storage.migrations compact-rewards
+    python -m storage.migrations rewards-from-workflows
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from storage.connection import get_database
+from activities.balance_activities import RECENT_TRANSACTIONS
+from activities.rewards_activities import POINTS_HISTORY_LIMIT, tier_expression
+from workflows.rewards_workflow import CustomerRewardsWorkflow
+from temporal_client import get_temporal_client
+from temporalio.client import WorkflowExecutionStatus
+
+
+def migrate_balance_ledger(db=None) -> dict:
+    """
+    Move the embedded balances.transactions arrays into the balance_ledger
+    collection, keeping only a capped recent_transactions tail on each
+    balance document.
+
+    Args:
+        db: Database to migrate, defaults to the shared application database
+
+    Returns:
+        dict: Number of balance documents and ledger entries migrated
+    """
+    db = db if db is not None else get_database()
+    migrated_users = 0
+    migrated_entries = 0
+
+    for balance_doc in db.balances.find({'transactions': {'$exists': True}}):
+        user_id = balance_doc['user_id']
+        transactions = balance_doc.get('transactions') or []
+
+        # Entries written before debit/credit had no reference; give them a
+        # stable one so a re-run upserts instead of duplicating
+        operations = []
+        for index, transaction in enumerate(transactions):
+            entry = dict(transaction, user_id=user_id)
+            entry.setdefault('reference', f"migrated:{user_id}:{index}")
+            operations.append(
+                UpdateOne({'reference': entry['reference']}, {'$setOnInsert': entry}, upsert=True)
+            )
+        if operations:
+            db.balance_ledger.bulk_write(operations, ordered=False)
+
+        # Prepend the old tail so entries written since the deploy are kept
+        db.balances.update_one(
+            {'_id': balance_doc['_id']},
+            {
+                '$push': {
+                    'recent_transactions': {
+                        '$each': transactions[-RECENT_TRANSACTIONS:],
+                        '$position': 0,
+                        '$slice': -RECENT_TRANSACTIONS
+                    }
+                },
+                '$unset': {'transactions': ''}
+            }
+        )
+        migrated_users += 1
+        migrated_entries += len(transactions)
+
+    return {'balances': migrated_users, 'ledger_entries': migrated_entries}
+
+
+def compact_rewards(db=None) -> dict:
+    """
+    Trim points_history on oversized rewards documents to the last
+    POINTS_HISTORY_LIMIT entries and make sure their tier matches their points.
+
+    Args:
+        db: Database to compact, defaults to the shared application database
+
+    Returns:
+        dict: Number of rewards documents compacted
+    """
+    db = db if db is not None else get_database()
+    result = db.rewards.update_many(
+        {f'points_history.{POINTS_HISTORY_LIMIT}': {'$exists': True}},
+        [{'$set': {
+            'points_history': {'$slice': ['$points_history', -POINTS_HISTORY_LIMIT]},
+            'tier': tier_expression('$total_points')
+        }}]
+    )
+    return {'rewards': result.modified_count}
+
+
+async def _chain_started_at(client, workflow_id: str):
+    """
+    Start time of the workflow's latest run chain: the runs linked by
+    continue-as-new that end in its current (or last) run. None if no run
+    is visible.
+    """
+    runs = [run async for run in client.list_workflows(f"WorkflowId = '{workflow_id}'")]
+    started_at = None
+    new_chain = True
+    for run in sorted(runs, key=lambda run: run.start_time):
+        if new_chain:
+            started_at = run.start_time
+        # A run that closed any other way ended its chain; a later run with
+        # the same id starts again from 0 points
+        new_chain = run.status != WorkflowExecutionStatus.CONTINUED_AS_NEW
+    return started_at
+
+
+async def rewards_from_workflows(db=None, client=None) -> dict:
+    """
+    Rewrite total_points and tier of every rewards document from its user's
+    rewards workflow, which holds the authoritative points. Repairs documents
+    inflated by batches that were applied more than once.
+
+    The workflow only counts points it received itself, so a document is
+    rewritten only when the workflow's current run chain started before the
+    document was created. Users whose workflow was closed and started again
+    since are left alone.
+
+    Users whose workflow cannot be queried, or has points in flight, are
+    skipped; their workflow is woken to retry a stored batch, and a re-run
+    picks them up.
+
+    Args:
+        db: Database to migrate, defaults to the shared application database
+        client: Temporal client, defaults to the shared client
+
+    Returns:
+        dict: Number of rewards documents rewritten, already correct, not
+        covered by their workflow, and skipped
+    """
+    db = db if db is not None else get_database()
+    client = client if client is not None else await get_temporal_client()
+    rewritten = unchanged = not_covered = skipped = 0
+
+    projection = {'user_id': 1, 'total_points': 1, 'tier': 1, 'created_at': 1, 'updated_at': 1}
+    for rewards_doc in db.rewards.find({}, projection):
+        workflow_id = f"rewards_{rewards_doc['user_id']}"
+        handle = client.get_workflow_handle_for(CustomerRewardsWorkflow.run, workflow_id)
+        try:
+            status = await handle.query(CustomerRewardsWorkflow.get_status)
+            chain_started_at = await _chain_started_at(client, workflow_id)
+        except Exception as e:
+            print(f"Could not query {workflow_id}: {str(e)}")
+            skipped += 1
+            continue
+
+        # created_at is written as local time by update_user_rewards
+        created_at = rewards_doc.get('created_at')
+        if created_at is None or chain_started_at is None or chain_started_at > created_at.astimezone(timezone.utc):
+            print(f"Leaving {rewards_doc['user_id']} alone: {workflow_id} does not cover all of its rewards")
+            not_covered += 1
+            continue
+        if status.get('pending_points'):
+            # A batch may already be written but not yet counted by the
+            # workflow. A batch whose flush failed waits for a wake-up.
+            print(f"Skipping {workflow_id}: {status['pending_points']} points in flight")
+            try:
+                await handle.signal(CustomerRewardsWorkflow.wake)
+            except Exception as e:
+                print(f"Could not wake {workflow_id}: {str(e)}")
+            skipped += 1
+            continue
+
+        if rewards_doc.get('total_points') == status['points'] and rewards_doc.get('tier') == status['tier']:
+            unchanged += 1
+            continue
+        # Only overwrite the document as read; a write since then means the
+        # queried points may already be stale
+        result = db.rewards.update_one(
+            {'_id': rewards_doc['_id'], 'updated_at': rewards_doc.get('updated_at')},
+            {'$set': {'total_points': status['points'], 'tier': status['tier'], 'updated_at': datetime.now()}}
+        )
+        if result.modified_count:
+            rewritten += 1
+        else:
+            print(f"Skipping {workflow_id}: rewards changed while migrating")
+            skipped += 1
+
+    return {'rewritten': rewritten, 'unchanged': unchanged, 'not_covered': not_covered, 'skipped': skipped}
+
+
+MIGRATIONS = {
+    'balance-ledger': migrate_balance_ledger,
+    'compact-rewards': compact_rewards,
+    'rewards-from-workflows': rewards_from_workflows
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a data migration")
+    parser.add_argument('migration', choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+
+    migration = MIGRATIONS[args.migration]
+    if asyncio.iscoroutinefunction(migration):
+        result = asyncio.run(migration())
+    else:
+        result = migration()
+    print(f"{args.migration}: " + ', '.join(f"{key}={value}" for key, value in result.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    sys.exit(main())
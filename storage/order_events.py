@@ -0,0 +1,185 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo.errors import OperationFailure
+from storage.connection import get_collection
+
+# Fields published for every order status change
+EVENT_FIELDS = ('order_id', 'user_id', 'status', 'updated_at', 'created_at')
+
+# Statuses after which an order produces no further events
+TERMINAL_STATUSES = ('completed', 'failed')
+
+# Polling re-reads this much history each time so writes that commit slightly
+# out of updated_at order are not missed; duplicates are filtered out
+POLL_OVERLAP = timedelta(seconds=2)
+
+
+class OrderEventHub:
+    """
+    Fan out order status changes to any number of in-process subscribers
+    (the SSE handlers) from a single upstream source.
+
+    The upstream is a MongoDB change stream on the orders collection. On a
+    standalone mongod, where change streams are not available, it falls back
+    to polling orders by updated_at. Either way N watchers cost one upstream
+    subscription, started with the first subscriber and stopped with the last.
+    """
+
+    def __init__(self, poll_interval: float = None, queue_size: int = 100):
+        self.poll_interval = poll_interval or float(os.getenv('ORDER_EVENTS_POLL_INTERVAL', '1'))
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._loop = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, order_id: str = None, user_id: str = None) -> asyncio.Queue:
+        """Register a subscriber for one order, one user's orders, or everything."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[queue] = (order_id, user_id)
+        if self._thread is None:
+            self._start()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.pop(queue, None)
+        if not self._subscribers:
+            self.stop()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread = None
+
+    def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(self._stop,),
+            name='order-events',
+            daemon=True
+        )
+        self._thread.start()
+
+    def _publish(self, event: dict):
+        # Runs on the event loop
+        for queue, (order_id, user_id) in list(self._subscribers.items()):
+            if order_id and event.get('order_id') != order_id:
+                continue
+            if user_id and event.get('user_id') != user_id:
+                continue
+            if queue.full():
+                # Slow consumer: drop its oldest event rather than block everyone
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def _emit(self, document: dict, transitions: list = None):
+        """
+        Publish one event per transition, or one for the document's current
+        status when no transitions are given. A single record_order_status
+        write can carry several transitions, and each is its own event.
+        """
+        base = {field: document.get(field) for field in EVENT_FIELDS}
+        if transitions:
+            events = [dict(base, status=entry.get('status'), updated_at=entry.get('at')) for entry in transitions]
+        else:
+            events = [base]
+        try:
+            for event in events:
+                self._loop.call_soon_threadsafe(self._publish, event)
+        except RuntimeError:
+            # Event loop closed during shutdown
+            self._stop.set()
+
+    def _run(self, stop: threading.Event):
+        orders = get_collection('orders')
+        while not stop.is_set():
+            try:
+                self._watch(orders, stop)
+            except OperationFailure as e:
+                # 40573: change streams need a replica set or sharded cluster
+                if e.code != 40573:
+                    print(f"Order change stream failed: {str(e)}")
+                self._poll(orders, stop)
+            except Exception as e:
+                print(f"Order event source failed, retrying: {str(e)}")
+                time.sleep(self.poll_interval)
+
+    def _watch(self, orders, stop: threading.Event):
+        pipeline = [
+            # Entries pushed onto status_history by this write, reported as
+            # status_history.<n> (or the whole array when it was created)
+            {'$addFields': {'pushedHistory': {'$filter': {
+                'input': {'$objectToArray': {'$ifNull': ['$updateDescription.updatedFields', {}]}},
+                'cond': {'$regexMatch': {'input': '$$this.k', 'regex': '^status_history(\\.|$)'}}
+            }}}},
+            {'$match': {'$or': [
+                {'operationType': 'insert'},
+                {'updateDescription.updatedFields.status': {'$exists': True}},
+                {'pushedHistory.0': {'$exists': True}}
+            ]}},
+            {'$project': {
+                'operationType': 1,
+                'pushedHistory': 1,
+                **{f'fullDocument.{field}': 1 for field in EVENT_FIELDS}
+            }}
+        ]
+        with orders.watch(pipeline, full_document='updateLookup', max_await_time_ms=1000) as stream:
+            while not stop.is_set():
+                change = stream.try_next()
+                if change and change.get('fullDocument'):
+                    self._emit(change['fullDocument'], pushed_transitions(change.get('pushedHistory')))
+
+    def _poll(self, orders, stop: threading.Event):
+        projection = {'_id': 0, 'status_history': 1, **{field: 1 for field in EVENT_FIELDS}}
+        started = datetime.utcnow()
+        last_seen = started
+        # Number of status_history entries already published, and the last
+        # write seen, per order
+        published = {}
+        while not stop.is_set():
+            since = last_seen - POLL_OVERLAP
+            cursor = orders.find({'updated_at': {'$gt': since}}, projection).sort('updated_at', 1)
+            for document in cursor:
+                last_seen = max(last_seen, document['updated_at'])
+                order_id = document.get('order_id')
+                history = document.get('status_history') or []
+                if order_id in published:
+                    new = history[published[order_id][0]:]
+                    if new:
+                        self._emit(document, new)
+                elif not history:
+                    self._emit(document)
+                elif (document.get('created_at') or started) >= started:
+                    # Placed since polling began: every transition is news
+                    self._emit(document, history)
+                else:
+                    # Earlier transitions happened before this hub was listening
+                    self._emit(document, history[-1:])
+                published[order_id] = (len(history), document['updated_at'], document.get('status'))
+            # Orders that finished are forgotten once they drop out of the overlap
+            published = {
+                order_id: state for order_id, state in published.items()
+                if state[2] not in TERMINAL_STATUSES or state[1] > since
+            }
+            stop.wait(self.poll_interval)
+
+
+def pushed_transitions(pushed_history) -> list:
+    """Flatten the status_history fields of a change event into transitions in order."""
+    transitions = []
+    for field in sorted(pushed_history or [], key=lambda field: _history_position(field['k'])):
+        if isinstance(field['v'], list):
+            transitions.extend(field['v'])
+        else:
+            transitions.append(field['v'])
+    return transitions
+
+
+def _history_position(key: str) -> int:
+    _, _, index = key.partition('.')
+    return int(index) if index.isdigit() else -1
@@ -0,0 +1,282 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from storage.connection import get_database
+
+# pymongo is a blocking driver, so every call made from an aiohttp handler is
+# pushed onto this bounded pool instead of running on the event loop. The pool
+# size caps how many Mongo operations the web process has in flight at once.
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the shared executor used for Mongo calls, creating it on first use."""
+    global _executor
+    if _executor is None:
+        max_workers = int(os.getenv('MONGODB_EXECUTOR_WORKERS', '16'))
+        _executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='mongo'
+        )
+    return _executor
+
+
+def shutdown_executor():
+    """Shut down the shared executor (called on application cleanup)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+class BaseRepository:
+    """Async facade over a single pymongo collection."""
+
+    collection_name = None
+
+    def __init__(self, db=None, executor: ThreadPoolExecutor = None):
+        self._db = db
+        self._executor = executor
+
+    @property
+    def collection(self):
+        # Resolved lazily so constructing a repository does not connect
+        return (self._db if self._db is not None else get_database())[self.collection_name]
+
+    async def _run(self, fn, *args, **kwargs):
+        """Run a blocking pymongo call on the executor and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor or get_executor(),
+            functools.partial(fn, *args, **kwargs)
+        )
+
+
+class OrdersRepository(BaseRepository):
+    collection_name = 'orders'
+
+    # Fields returned by default when listing orders. The detail blobs written
+    # by update_order_status are only included when explicitly requested.
+    SUMMARY_FIELDS = ('order_id', 'status', 'total', 'items', 'created_at')
+    DETAIL_FIELDS = ('payment_details', 'inventory_details', 'shipping_details', 'points_added', 'reason', 'error')
+
+    async def list_orders(self, limit: int = 50, after: tuple = None, statuses: list = None, fields: list = None) -> list:
+        """
+        List orders newest first using keyset pagination over (created_at, order_id).
+
+        Args:
+            limit: Maximum number of orders to return
+            after: (created_at, order_id) of the last order on the previous page
+            statuses: Only return orders in one of these statuses
+            fields: Extra detail fields to include on top of the summary projection
+
+        Returns:
+            list: Order documents
+        """
+        query = {}
+        if statuses:
+            query['status'] = {'$in': statuses}
+        if after:
+            created_at, order_id = after
+            query['$or'] = [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, 'order_id': {'$lt': order_id}}
+            ]
+
+        projection = {'_id': 0}
+        for field in self.SUMMARY_FIELDS + tuple(fields or ()):
+            projection[field] = 1
+
+        def find():
+            cursor = self.collection.find(query, projection).sort(
+                [('created_at', -1), ('order_id', -1)]
+            ).limit(limit)
+            return list(cursor)
+
+        return await self._run(find)
+
+    async def get_order_status(self, order_id: str):
+        return await self._run(
+            self.collection.find_one,
+            {'order_id': order_id},
+            {'_id': 0, 'order_id': 1, 'user_id': 1, 'status': 1, 'updated_at': 1, 'created_at': 1}
+        )
+
+    async def iter_order_batches(self, query: dict, batch_size: int = 500):
+        """
+        Yield full order documents in batches straight off a Mongo cursor.
+
+        Only one batch is held in memory at a time, so this is safe to use for
+        exporting the whole collection.
+
+        Args:
+            query: Mongo filter for the orders to export
+            batch_size: Number of documents fetched per round trip
+
+        Yields:
+            list: Up to batch_size order documents
+        """
+        cursor = self.collection.find(query, {'_id': 0}).sort(
+            [('created_at', 1), ('order_id', 1)]
+        ).batch_size(batch_size)
+
+        def next_batch():
+            batch = []
+            for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    break
+            return batch
+
+        try:
+            while True:
+                batch = await self._run(next_batch)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            await self._run(cursor.close)
+
+    async def insert_order(self, order: dict) -> tuple:
+        """
+        Insert an order in a single write.
+
+        If the order carries an idempotency_key that was already used, the
+        existing order is returned instead of inserting a duplicate.
+
+        Returns:
+            tuple: (order document, True if it was inserted by this call)
+        """
+        def insert():
+            try:
+                self.collection.insert_one(order)
+                return order, True
+            except DuplicateKeyError:
+                if not order.get('idempotency_key'):
+                    raise
+                existing = self.collection.find_one({'idempotency_key': order['idempotency_key']})
+                if existing is None:
+                    raise
+                return existing, False
+
+        return await self._run(insert)
+
+    async def insert_orders(self, orders: list) -> list:
+        """
+        Insert many orders with one unordered insert_many.
+
+        Orders whose idempotency_key was already used resolve to the existing
+        order, like insert_order.
+
+        Returns:
+            list: (order document, inserted by this call, error message or None)
+            for each order, in input order
+        """
+        def insert():
+            results = [(order, True, None) for order in orders]
+            try:
+                self.collection.insert_many(orders, ordered=False)
+            except BulkWriteError as e:
+                duplicates = {}
+                for error in e.details.get('writeErrors', []):
+                    index = error['index']
+                    key = orders[index].get('idempotency_key')
+                    if error.get('code') == 11000 and key:
+                        duplicates[key] = index
+                    else:
+                        results[index] = (orders[index], False, error.get('errmsg', 'insert failed'))
+                if duplicates:
+                    existing = self.collection.find({'idempotency_key': {'$in': list(duplicates)}})
+                    for doc in existing:
+                        index = duplicates.pop(doc['idempotency_key'])
+                        results[index] = (doc, False, None)
+                    for index in duplicates.values():
+                        results[index] = (orders[index], False, 'duplicate order')
+            return results
+
+        return await self._run(insert)
+
+
+class InventoryRepository(BaseRepository):
+    collection_name = 'inventory'
+
+    async def list_items(self) -> list:
+        # 'reserving', 'releasing' and legacy 'holds' are reservation
+        # bookkeeping written by reserve_inventory and release_inventory
+        return await self._run(lambda: list(self.collection.find(
+            {},
+            {'_id': 0, 'reserving': 0, 'releasing': 0, 'holds': 0}
+        )))
+
+
+class CatalogVersionsRepository(BaseRepository):
+    """Change counters bumped by every write to a catalog collection (see storage.catalog)."""
+
+    collection_name = 'catalog_versions'
+
+    async def get_version(self, name: str):
+        """Return the version document for a catalog, or None if it was never written."""
+        return await self._run(self.collection.find_one, {'_id': name})
+
+
+class BalancesRepository(BaseRepository):
+    collection_name = 'balances'
+
+    async def get_balance(self, user_id: str, recent: int = 5):
+        """Return the balance document with only the last `recent` transactions."""
+        return await self._run(
+            self.collection.find_one,
+            {'user_id': user_id},
+            {
+                '_id': 0,
+                'balance': 1,
+                'recent_transactions': {'$slice': -recent},
+                # Documents not yet migrated to the ledger
+                'transactions': {'$slice': -recent}
+            }
+        )
+
+
+class BalanceLedgerRepository(BaseRepository):
+    collection_name = 'balance_ledger'
+
+    async def list_transactions(self, user_id: str, limit: int = 20, before: tuple = None) -> list:
+        """
+        List a user's transactions newest first using keyset pagination over (timestamp, _id).
+
+        Args:
+            user_id: The ID of the user
+            limit: Maximum number of transactions to return
+            before: (timestamp, _id) of the last transaction on the previous page
+
+        Returns:
+            list: Ledger entries
+        """
+        query = {'user_id': user_id}
+        if before:
+            timestamp, entry_id = before
+            query['$or'] = [
+                {'timestamp': {'$lt': timestamp}},
+                {'timestamp': timestamp, '_id': {'$lt': entry_id}}
+            ]
+
+        def find():
+            cursor = self.collection.find(query, {'user_id': 0}).sort(
+                [('timestamp', -1), ('_id', -1)]
+            ).limit(limit)
+            return list(cursor)
+
+        return await self._run(find)
+
+
+class RewardsRepository(BaseRepository):
+    collection_name = 'rewards'
+
+    async def get_rewards(self, user_id: str):
+        return await self._run(
+            self.collection.find_one,
+            {'user_id': user_id},
+            {'_id': 0, 'total_points': 1, 'tier': 1}
+        )
@@ -0,0 +1,21 @@
+from temporalio.client import Client
+
+TEMPORAL_ADDRESS = "localhost:7233"
+TASK_QUEUE = "ecommerce-task-queue"
+
+# Shared Temporal client, created on first use. The web app and the worker
+# (including activities that start or signal workflows) reuse one connection.
+temporal_client = None
+
+async def get_temporal_client():
+    global temporal_client
+    if temporal_client is None:
+        try:
+            temporal_client = await Client.connect(TEMPORAL_ADDRESS)
+            print("Successfully connected to Temporal server")
+        except Exception as e:
+            print(f"Failed to connect to Temporal server: {str(e)}")
+            print(f"Please ensure Temporal server is running on {TEMPORAL_ADDRESS}")
+            print("You can start it using: docker run -d -p 7233:7233 -p 7234:7234 -p 7235:7235 temporalio/auto-setup:1.20")
+            raise
+    return temporal_client
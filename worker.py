@@ -1,47 +1,108 @@
+import argparse
 import asyncio
-from temporalio.client import Client
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 from temporalio.worker import Worker
 from workflows.order_workflow import OrderProcessingWorkflow
 from workflows.rewards_workflow import CustomerRewardsWorkflow
-from workflows.shipping_workflow import ShippingWorkflow
+from workflows.shipping_workflow import ShippingWorkflow, ParcelShippingWorkflow
 from activities.payment_activities import process_payment, refund_payment
-from activities.inventory_activities import check_inventory, update_inventory
-from activities.shipping_activities import generate_shipping_label, schedule_pickup, mark_delivered
+from activities.inventory_activities import check_inventory, update_inventory, reserve_inventory, release_inventory
+from activities.shipping_activities import generate_shipping_label, generate_parcel_label, schedule_pickup, mark_delivered
 from activities.notification_activities import send_notification
-from activities.order_activities import update_order_status
-from activities.rewards_activities import update_user_rewards
-from activities.balance_activities import check_balance, update_balance
+from activities.order_activities import update_order_status, record_order_status
+from activities.rewards_activities import update_user_rewards, signal_rewards
+from activities.balance_activities import check_balance, update_balance, debit_balance, credit_balance
+from storage.connection import health as mongo_health
+from storage.indexes import report_missing_indexes
+from temporal_client import get_temporal_client, TASK_QUEUE
+import simulation
 
-async def main():
-    # Create client connected to server at the given address
-    client = await Client.connect("localhost:7233")
+# Load environment variables
+load_dotenv()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the ecommerce Temporal worker")
+    parser.add_argument(
+        "--max-concurrent-activities",
+        type=int,
+        default=int(os.getenv("MAX_CONCURRENT_ACTIVITIES", "50")),
+        help="Maximum number of activities this worker runs at once (env: MAX_CONCURRENT_ACTIVITIES)"
+    )
+    parser.add_argument(
+        "--activity-threads",
+        type=int,
+        default=int(os.getenv("ACTIVITY_THREADS", "0")) or None,
+        help="Size of the thread pool for blocking activities; defaults to "
+             "--max-concurrent-activities (env: ACTIVITY_THREADS)"
+    )
+    return parser.parse_args()
+
+async def main(args):
+    # Create the shared client; activities that signal workflows reuse it
+    client = await get_temporal_client()
+    
+    # All activities share one MongoClient; report its health before polling
+    mongo = mongo_health()
+    if mongo['status'] == 'ok':
+        print(f"MongoDB reachable ({mongo['latency_ms']}ms, max_pool_size={mongo['max_pool_size']})")
+        report_missing_indexes()
+    else:
+        print(f"WARNING: MongoDB health check failed: {mongo['error']}")
+    
+    # Simulated delays and failure rates of the activities
+    profile = simulation.get_profile()
+    print(f"Simulation profile: {profile['name']}")
+    
+    # Activities are plain (blocking) functions that sleep and call pymongo,
+    # so they run on a thread pool rather than on the worker's event loop.
+    # The pool should be at least as large as max_concurrent_activities,
+    # otherwise activity tasks queue up waiting for a free thread.
+    activity_threads = args.activity_threads or args.max_concurrent_activities
+    activity_executor = ThreadPoolExecutor(
+        max_workers=activity_threads,
+        thread_name_prefix="activity"
+    )
     
     # Run a worker for the "ecommerce-task-queue" queue
     async with Worker(
         client,
-        task_queue="ecommerce-task-queue",
+        task_queue=TASK_QUEUE,
+        activity_executor=activity_executor,
+        max_concurrent_activities=args.max_concurrent_activities,
         workflows=[
             OrderProcessingWorkflow,
             CustomerRewardsWorkflow,
-            ShippingWorkflow
+            ShippingWorkflow,
+            ParcelShippingWorkflow
         ],
         activities=[
             process_payment,
             refund_payment,
             check_inventory,
             update_inventory,
+            reserve_inventory,
+            release_inventory,
             generate_shipping_label,
+            generate_parcel_label,
             schedule_pickup,
             mark_delivered,
             send_notification,
             update_order_status,
+            record_order_status,
             update_user_rewards,
+            signal_rewards,
             check_balance,
-            update_balance
+            update_balance,
+            debit_balance,
+            credit_balance
         ]
     ):
-        print("Worker started, listening on task queue 'ecommerce-task-queue'")
+        print(f"Worker started, listening on task queue '{TASK_QUEUE}' "
+              f"(max_concurrent_activities={args.max_concurrent_activities}, "
+              f"activity_threads={activity_threads})")
         await asyncio.Future()  # run forever
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main(parse_args()))
\ No newline at end of file
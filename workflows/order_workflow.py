@@ -1,22 +1,98 @@
 from temporalio import workflow
-from temporalio.workflow import ParentClosePolicy
 from temporalio.common import RetryPolicy
 from datetime import timedelta
-import random
 import asyncio
 from dataclasses import dataclass
-from workflows.rewards_workflow import CustomerRewardsWorkflow
+from workflows.shipping_workflow import plan_parcels
 
 @dataclass
 class OrderRequest:
     user_id: str
     order_id: str
     items: list
+    # "parcel" ships items grouped into parcels, one child workflow each;
+    # "per_item" starts a ShippingWorkflow per line item. The default keeps
+    # orders started before parcels existed replaying as they ran.
+    shipping_mode: str = "per_item"
+    # Line items per parcel in "parcel" mode, 0 for no limit
+    max_items_per_parcel: int = 0
+    # Simulated shipping timer delays passed to the shipping workflows (see
+    # simulation.py); None keeps their built-in timers
+    shipping_delays: dict = None
+
+def error_message(error: Exception) -> str:
+    """
+    Message of the innermost cause of an error. An activity failure arrives
+    as an ActivityError that only says "Activity task failed"; the reason,
+    e.g. insufficient balance or stock, is on its cause.
+    """
+    while getattr(error, "cause", None) is not None:
+        error = error.cause
+    return str(error)
 
 @workflow.defn
 class OrderProcessingWorkflow:
+    def __init__(self):
+        self._order_id = None
+        self._status = "initiated"
+        # Every transition, exposed through the get_status query
+        self._status_history = []
+        # Transitions not yet written to MongoDB
+        self._pending_transitions = []
+        # Outcome of payment and inventory reservation, returned by the
+        # wait_for_checkout update once it is known
+        self._checkout_result = None
+
+    def _set_status(self, status: str, details: dict = None):
+        """Record a status transition in workflow state; it is persisted on the next flush."""
+        transition = {"status": status, "at": workflow.now().isoformat()}
+        if details:
+            transition["details"] = details
+        self._status = status
+        self._status_history.append({"status": status, "at": transition["at"]})
+        self._pending_transitions.append(transition)
+
+    async def _flush_status(self):
+        """Write all buffered transitions to the order document in one local activity."""
+        if not self._pending_transitions:
+            return
+        transitions = self._pending_transitions
+        self._pending_transitions = []
+        try:
+            await workflow.execute_local_activity(
+                "record_order_status",
+                args=[self._order_id, transitions],
+                start_to_close_timeout=timedelta(seconds=5),
+                retry_policy=RetryPolicy(
+                    initial_interval=timedelta(seconds=1),
+                    maximum_interval=timedelta(seconds=10),
+                    maximum_attempts=3
+                )
+            )
+        except Exception:
+            # Keep the transitions so a later flush can still persist them
+            self._pending_transitions = transitions + self._pending_transitions
+            raise
+
+    @workflow.query
+    def get_status(self) -> dict:
+        """Query the live order status and its transition history."""
+        return {
+            "order_id": self._order_id,
+            "status": self._status,
+            "status_history": self._status_history
+        }
+
+    @workflow.update
+    async def wait_for_checkout(self) -> dict:
+        """Update that completes once payment and inventory reservation have succeeded or failed."""
+        await workflow.wait_condition(lambda: self._checkout_result is not None)
+        return self._checkout_result
+
     @workflow.run
     async def process(self, request: OrderRequest) -> dict:
+        self._order_id = request.order_id
+        
         # Set retry policy for activities
         retry_policy = RetryPolicy(
             initial_interval=timedelta(seconds=1),
@@ -30,107 +106,115 @@ class OrderProcessingWorkflow:
             "retry_policy": retry_policy
         }
         
-        try:
-            # Update order status to processing
-            await workflow.execute_activity(
-                "update_order_status",
-                args=[request.order_id, "processing"],
-                **default_activity_options
+        # Giving back a debited balance must not be abandoned after a few
+        # seconds; credit_balance is idempotent per order, so retry it until
+        # it succeeds
+        compensation_activity_options = {
+            "start_to_close_timeout": timedelta(seconds=10),
+            "retry_policy": RetryPolicy(
+                initial_interval=timedelta(seconds=1),
+                maximum_interval=timedelta(seconds=60)
             )
+        }
+        
+        # Which step the order is in, used to decide on compensation if it fails
+        stage = "payment"
+        # Set when payment failed after the debit, for reporting a failed refund
+        payment_error = None
+        
+        try:
+            # Status transitions are buffered and flushed at checkpoints
+            self._set_status("processing")
             
             # Calculate total amount
             total_amount = sum(item['price'] * item['quantity'] for item in request.items)
             
-            # Check balance before processing payment
-            balance_check = await workflow.execute_activity(
-                "check_balance",
-                args=[request.user_id, total_amount],
+            # Check and debit the balance in one atomic, idempotent step
+            await workflow.execute_activity(
+                "debit_balance",
+                args=[request.user_id, request.order_id, total_amount],
                 **default_activity_options
             )
             
-            if balance_check['status'] != 'sufficient':
-                raise Exception(f"Insufficient balance. Required: {total_amount}, Available: {balance_check['current_balance']}")
-            
             # Process payment
             payment_activity_options = {
                 "schedule_to_close_timeout": timedelta(seconds=10),
                 "retry_policy": retry_policy
             }
-            payment_result = await workflow.execute_activity(
-                "process_payment",
-                args=[request.user_id, request.order_id, request.items],
-                **payment_activity_options
-            )
+            try:
+                payment_result = await workflow.execute_activity(
+                    "process_payment",
+                    args=[request.user_id, request.order_id, request.items],
+                    **payment_activity_options
+                )
+            except Exception as error:
+                # The balance is debited; until it is credited back a failure
+                # means the user's money is held
+                payment_error = error
+                stage = "payment_refund"
+                await workflow.execute_activity(
+                    "credit_balance",
+                    args=[request.user_id, request.order_id, total_amount, "refund"],
+                    **compensation_activity_options
+                )
+                stage = "payment"
+                raise
             
-            # Update balance after successful payment
-            await workflow.execute_activity(
-                "update_balance",
-                args=[request.user_id, -total_amount, "payment"],
-                **default_activity_options
-            )
+            stage = "inventory"
             
-            # Update order status after payment
-            await workflow.execute_activity(
-                "update_order_status",
-                args=[request.order_id, "payment_processed", {"payment_details": payment_result}],
-                **default_activity_options
-            )
+            # Update order status after payment (checkpoint)
+            self._set_status("payment_processed", {"payment_details": payment_result})
+            await self._flush_status()
             
-            # Check inventory
+            # Check and reserve stock for all items in one batched activity
             inventory_result = await workflow.execute_activity(
-                "check_inventory",
-                args=[request.items],
+                "reserve_inventory",
+                args=[request.order_id, request.items],
                 **default_activity_options
             )
             
-            # Update order status after inventory check
-            await workflow.execute_activity(
-                "update_order_status",
-                args=[request.order_id, "inventory_checked", {"inventory_details": inventory_result}],
-                **default_activity_options
-            )
+            # Update order status after inventory reservation
+            self._set_status("inventory_reserved", {"inventory_details": inventory_result})
+            stage = "fulfillment"
             
-            # Update inventory levels
-            await workflow.execute_activity(
-                "update_inventory",
-                args=[request.items],
-                **default_activity_options
-            )
-            
-            # Update order status after inventory update
-            await workflow.execute_activity(
-                "update_order_status",
-                args=[request.order_id, "inventory_updated"],
-                **default_activity_options
-            )
+            # Update order status to shipping (checkpoint before the long-running shipping step)
+            self._set_status("shipping")
+            await self._flush_status()
             
-            # Update order status to shipping
-            await workflow.execute_activity(
-                "update_order_status",
-                args=[request.order_id, "shipping"],
-                **default_activity_options
-            )
+            # Payment and stock are secured; release synchronous checkout callers
+            self._checkout_result = {
+                "status": "confirmed",
+                "order_id": request.order_id,
+                "payment_status": payment_result,
+                "inventory_status": inventory_result
+            }
             
             # Simulate shipping with child workflows
             shipping_tasks = []
-            for item in request.items:
-                shipping_tasks.append(
-                    workflow.execute_child_workflow(
-                        "ShippingWorkflow",
-                        args=[item],
-                        id=f"shipping_{request.order_id}_{item['sku']}"
+            if request.shipping_mode == "parcel":
+                for parcel in plan_parcels(request.order_id, request.items, request.max_items_per_parcel):
+                    shipping_tasks.append(
+                        workflow.execute_child_workflow(
+                            "ParcelShippingWorkflow",
+                            args=[parcel, request.shipping_delays],
+                            id=f"shipping_{parcel['parcel_id']}"
+                        )
+                    )
+            else:
+                for item in request.items:
+                    shipping_tasks.append(
+                        workflow.execute_child_workflow(
+                            "ShippingWorkflow",
+                            args=[item, request.shipping_delays],
+                            id=f"shipping_{request.order_id}_{item['sku']}"
+                        )
                     )
-                )
             
             # Wait for all shipping tasks to complete
             shipping_results = await asyncio.gather(*shipping_tasks)
             
             # Update order status after shipping
-            await workflow.execute_activity(
-                "update_order_status",
-                args=[request.order_id, "shipped", {"shipping_details": shipping_results}],
-                **default_activity_options
-            )
+            self._set_status("shipped", {"shipping_details": shipping_results})
             
             # Send notification
             await workflow.execute_activity(
@@ -143,67 +227,24 @@ class OrderProcessingWorkflow:
             total_points = int(sum(item['price'] * item['quantity'] for item in request.items))
             
             
-            # Use a safer approach - always try to start the rewards workflow first
-            # If it already exists, it will just return the existing one
-            # I have used the workflow_id to get the existing workflow
-            # and signal it with the points
-            # If the workflow doesn't exist, it will start a new one
-            # As the signal will fail
+            # Deliver the points to the user's rewards workflow. The activity uses
+            # signal-with-start, so the workflow is created on the first order.
             try:
-                rewards_id = f"rewards_{request.user_id}"
-
-                try:
-                    # Try to get existing workflow first
-                    workflow_handle = workflow.get_external_workflow_handle(
-                        #CustomerRewardsWorkflow,
-                        workflow_id="rewards_default_user"
-                    )
-                    print("\n\n Before signal\n\n")
-                    # Signal the rewards workflow with the points
-                    await workflow_handle.signal("add_points", total_points)
-
-                except Exception as e:
-                    print(f"Exception in workflow try for rewards workflow: {e}")
-                    # Workflow doesn't exist, start a new one  
-                    workflow_handle = await workflow.start_child_workflow(
-                        "CustomerRewardsWorkflow",
-                        args=[request.user_id],
-                        id=rewards_id,
-                        # Unsure if this is the right way to do this
-                        # I think it is because the rewards workflow is a child workflow
-                        # and it should be abandoned if the parent workflow fails
-                        # but I am not sure
-                        parent_close_policy=ParentClosePolicy.ABANDON
-                    )
-                    # Send a notification that the rewards workflow has been started
-                    await workflow.execute_activity(
-                        "send_notification",
-                        args=[request.user_id, request.order_id, "rewards_workflow_started"],
-                        **default_activity_options
-                    )
-                    # Wait a moment for workflow to initialize
-                    await asyncio.sleep(1)
-                    # Signal the rewards workflow with the points
-                    await workflow_handle.signal("add_points", total_points)
-                
-                # Update order status with rewards
                 await workflow.execute_activity(
-                    "update_order_status",
-                    args=[request.order_id, "rewards_added", {"points_added": total_points}],
+                    "signal_rewards",
+                    args=[request.user_id, request.order_id, total_points],
                     **default_activity_options
                 )
+                
+                # Update order status with rewards
+                self._set_status("rewards_added", {"points_added": total_points})
             except Exception as e:
                 # Log but don't fail the main workflow if rewards update fails
                 print(f"Failed to update rewards: {str(e)}")
-                # Continue without failing the order
-                pass
             
-            # Update order status to completed
-            await workflow.execute_activity(
-                "update_order_status",
-                args=[request.order_id, "completed"],
-                **default_activity_options
-            )
+            # Update order status to completed (final checkpoint)
+            self._set_status("completed")
+            await self._flush_status()
             
             return {
                 "status": "completed",
@@ -216,25 +257,51 @@ class OrderProcessingWorkflow:
         except Exception as e:
             # Handle failures
             print(f"Order workflow encountered an error: {str(e)}")
-            if "payment" in str(e) or "balance" in str(e):
-                # Payment or balance check failed - no need to compensate
+            if self._checkout_result is None:
+                self._checkout_result = {
+                    "status": "failed",
+                    "order_id": request.order_id,
+                    "stage": stage,
+                    "error": error_message(payment_error or e)
+                }
+            if stage == "payment":
+                # Debit or payment failed - the debit is either not applied or already credited back
                 # Update order status to failed
                 try:
-                    await workflow.execute_activity(
-                        "update_order_status",
-                        args=[request.order_id, "failed", {"reason": "payment_failed", "error": str(e)}],
-                        **default_activity_options
-                    )
+                    self._set_status("failed", {"reason": "payment_failed", "error": str(e)})
+                    await self._flush_status()
                 except Exception as update_error:
                     print(f"Failed to update order status: {str(update_error)}")
                 
                 return {"status": "failed", "reason": "payment_failed", "error": str(e)}
-            elif "inventory" in str(e):
-                # Inventory failed - refund payment and restore balance
+            elif stage == "payment_refund":
+                # Payment failed and crediting the debit back failed too; the
+                # balance stays debited until it is refunded by hand
+                print(f"Refund failed after payment error: {str(e)}")
+                try:
+                    self._set_status("failed", {
+                        "reason": "payment_failed_and_refund_failed",
+                        "error": str(payment_error),
+                        "refund_error": str(e)
+                    })
+                    await self._flush_status()
+                except Exception as update_error:
+                    print(f"Failed to update order status: {str(update_error)}")
+                
+                return {"status": "failed", "reason": "payment_failed_and_refund_failed", "error": str(payment_error), "refund_error": str(e)}
+            elif stage == "inventory":
+                # Inventory failed - release any partial reservation, refund payment and restore balance
                 try:
                     # Calculate total amount for refund
                     total_amount = sum(item['price'] * item['quantity'] for item in request.items)
                     
+                    # Release any reserved stock (only SKUs still held by this order)
+                    await workflow.execute_activity(
+                        "release_inventory",
+                        args=[request.order_id, request.items],
+                        **default_activity_options
+                    )
+                    
                     # Refund payment
                     await workflow.execute_activity(
                         "refund_payment",
@@ -242,20 +309,17 @@ class OrderProcessingWorkflow:
                         **default_activity_options
                     )
                     
-                    # Restore balance
+                    # Restore balance (idempotent per order)
                     await workflow.execute_activity(
-                        "update_balance",
-                        args=[request.user_id, total_amount, "refund"],
-                        **default_activity_options
+                        "credit_balance",
+                        args=[request.user_id, request.order_id, total_amount, "refund"],
+                        **compensation_activity_options
                     )
                     
                     # Update order status to failed with refund
                     try:
-                        await workflow.execute_activity(
-                            "update_order_status",
-                            args=[request.order_id, "failed", {"reason": "inventory_failed", "refund_status": "success", "error": str(e)}],
-                            **default_activity_options
-                        )
+                        self._set_status("failed", {"reason": "inventory_failed", "refund_status": "success", "error": str(e)})
+                        await self._flush_status()
                     except Exception as update_error:
                         print(f"Failed to update order status: {str(update_error)}")
                     
@@ -265,26 +329,30 @@ class OrderProcessingWorkflow:
                     
                     # Update order status to failed with failed refund
                     try:
-                        await workflow.execute_activity(
-                            "update_order_status",
-                            args=[request.order_id, "failed", {
-                                "reason": "inventory_failed_and_refund_failed", 
-                                "error": str(e), 
-                                "refund_error": str(refund_error)
-                            }],
-                            **default_activity_options
-                        )
+                        self._set_status("failed", {
+                            "reason": "inventory_failed_and_refund_failed", 
+                            "error": str(e), 
+                            "refund_error": str(refund_error)
+                        })
+                        await self._flush_status()
                     except Exception as update_error:
                         print(f"Failed to update order status: {str(update_error)}")
                     
                     return {"status": "failed", "reason": "inventory_failed_and_refund_failed", "error": str(e), "refund_error": str(refund_error)}
             else:
-                # Other failures - attempt refund and restore balance
+                # Other failures - release stock, attempt refund and restore balance
                 print(f"Processing failed with error: {str(e)}")
                 try:
                     # Calculate total amount for refund
                     total_amount = sum(item['price'] * item['quantity'] for item in request.items)
                     
+                    # Release any reserved stock (only SKUs still held by this order)
+                    await workflow.execute_activity(
+                        "release_inventory",
+                        args=[request.order_id, request.items],
+                        **default_activity_options
+                    )
+                    
                     # Refund payment
                     await workflow.execute_activity(
                         "refund_payment",
@@ -292,20 +360,17 @@ class OrderProcessingWorkflow:
                         **default_activity_options
                     )
                     
-                    # Restore balance
+                    # Restore balance (idempotent per order)
                     await workflow.execute_activity(
-                        "update_balance",
-                        args=[request.user_id, total_amount, "refund"],
-                        **default_activity_options
+                        "credit_balance",
+                        args=[request.user_id, request.order_id, total_amount, "refund"],
+                        **compensation_activity_options
                     )
                     
                     # Update order status to failed with refund
                     try:
-                        await workflow.execute_activity(
-                            "update_order_status",
-                            args=[request.order_id, "failed", {"reason": "processing_failed", "refund_status": "success", "error": str(e)}],
-                            **default_activity_options
-                        )
+                        self._set_status("failed", {"reason": "processing_failed", "refund_status": "success", "error": str(e)})
+                        await self._flush_status()
                     except Exception as update_error:
                         print(f"Failed to update order status: {str(update_error)}")
                     
@@ -315,15 +380,12 @@ class OrderProcessingWorkflow:
                     
                     # Update order status to failed with failed refund
                     try:
-                        await workflow.execute_activity(
-                            "update_order_status",
-                            args=[request.order_id, "failed", {
-                                "reason": "processing_failed_and_refund_failed", 
-                                "error": str(e), 
-                                "refund_error": str(refund_error)
-                            }],
-                            **default_activity_options
-                        )
+                        self._set_status("failed", {
+                            "reason": "processing_failed_and_refund_failed", 
+                            "error": str(e), 
+                            "refund_error": str(refund_error)
+                        })
+                        await self._flush_status()
                     except Exception as update_error:
                         print(f"Failed to update order status: {str(update_error)}")
                     
@@ -1,6 +1,20 @@
 from temporalio import workflow
 from temporalio.common import RetryPolicy
 from datetime import timedelta
+import asyncio
+
+# Number of recent order ids remembered to drop duplicate add_points signals
+SEEN_ORDERS_LIMIT = 1000
+
+# Continue-as-new once the history reaches this many events (or earlier if the
+# server suggests it), well below Temporal's hard limits, so replaying a
+# long-lived customer's workflow stays cheap
+HISTORY_LENGTH_LIMIT = 10000
+
+# Point signals are buffered and persisted together: a flush happens once this
+# many signals are queued, or FLUSH_INTERVAL after the first one arrived
+FLUSH_MAX_SIGNALS = 20
+FLUSH_INTERVAL = timedelta(seconds=5)
 
 @workflow.defn
 class CustomerRewardsWorkflow:
@@ -9,6 +23,14 @@ class CustomerRewardsWorkflow:
         self._initialized = False
         self.points = 0
         self._should_close = False  # Add flag for closing
+        # Points signalled but not yet applied. Signals only enqueue here so
+        # they are safe to receive before run() has started (signal-with-start).
+        self._pending_points = []
+        self._seen_orders = []
+        # Batch being persisted; kept with its id until the write succeeds so
+        # a retry re-sends the same batch and the activity can skip it if the
+        # earlier attempt did write
+        self._flushing = None
         
     def _calculate_tier(self, total_points: int) -> str:
         """Calculate tier based on total points."""
@@ -20,12 +42,28 @@ class CustomerRewardsWorkflow:
             return "silver"
         return "basic"
         
+    def _should_continue_as_new(self) -> bool:
+        info = workflow.info()
+        return (
+            info.is_continue_as_new_suggested()
+            or info.get_current_history_length() >= HISTORY_LENGTH_LIMIT
+        )
+
     @workflow.run
-    async def run(self, user_id: str) -> dict:
-        """Initialize the workflow with a user ID and rewards state."""
+    async def run(self, user_id: str, points: int = 0, pending_points: list = None, seen_orders: list = None) -> dict:
+        """
+        Initialize the workflow with a user ID and rewards state.
+        
+        points, pending_points and seen_orders are only passed when the
+        workflow continues as new, to carry its state into the next run.
+        """
         # Initialize workflow state
         self._user_id = user_id
         self._initialized = True
+        self.points += points
+        # Signals received before run() started are already queued; keep them after the carried-over ones
+        self._pending_points = (pending_points or []) + self._pending_points
+        self._seen_orders = ((seen_orders or []) + self._seen_orders)[-SEEN_ORDERS_LIMIT:]
         
         # Define activity options
         activity_options = {
@@ -37,8 +75,48 @@ class CustomerRewardsWorkflow:
             )
         }
         
-        # Keep workflow running until close signal is received
-        await workflow.wait_condition(lambda: self._should_close)
+        # Apply points in batches as signals arrive; keep running until close signal is received
+        while True:
+            # A batch kept after a failed flush is retried without waiting for
+            # another order to arrive
+            await workflow.wait_condition(
+                lambda: bool(self._pending_points) or self._flushing is not None or self._should_close
+            )
+            if not workflow.patched("rewards-batching"):
+                # Runs started before batching existed must keep applying each
+                # signal immediately, or their histories no longer replay.
+                # They switch to batching at their next continue-as-new.
+                while self._pending_points:
+                    await self._apply_points(self._pending_points.pop(0), activity_options)
+                if self._should_close:
+                    break
+                if self._should_continue_as_new():
+                    workflow.continue_as_new(
+                        args=[user_id, self.points, self._pending_points, self._seen_orders]
+                    )
+                continue
+            if not self._should_close:
+                # Give a burst of orders a short window to coalesce into one flush
+                try:
+                    await workflow.wait_condition(
+                        lambda: len(self._pending_points) >= FLUSH_MAX_SIGNALS or self._should_close,
+                        timeout=FLUSH_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            if (self._pending_points or self._flushing) and not await self._flush_points(activity_options):
+                # Persisting failed; back off before retrying the same batch
+                await workflow.sleep(FLUSH_INTERVAL)
+                continue
+            if self._should_close:
+                break
+            if self._should_continue_as_new():
+                # Everything queued so far has been flushed; anything signalled
+                # while this task completes is carried over in pending_points
+                workflow.continue_as_new(
+                    args=[user_id, self.points, self._pending_points, self._seen_orders]
+                )
+        
         return {
             "status": "completed",
             "user_id": user_id,
@@ -47,24 +125,19 @@ class CustomerRewardsWorkflow:
         }
     
     @workflow.signal
-    async def add_points(self, points: int):
+    def add_points(self, points: int, order_id: str = None):
         """Signal handler to add points to user's rewards"""
-        if not self._initialized or not self._user_id:
-            raise ValueError("Workflow not properly initialized")
-            
-        # Set retry policy for activities
-        retry_policy = RetryPolicy(
-            initial_interval=timedelta(seconds=1),
-            maximum_interval=timedelta(seconds=10),
-            maximum_attempts=3
-        )
-        
-        # Define activity options
-        activity_options = {
-            "schedule_to_close_timeout": timedelta(seconds=5),
-            "retry_policy": retry_policy
-        }
-        
+        # An order's points may be signalled more than once if the sending
+        # activity is retried; only count them once
+        if order_id:
+            if order_id in self._seen_orders:
+                return
+            self._seen_orders.append(order_id)
+            self._seen_orders = self._seen_orders[-SEEN_ORDERS_LIMIT:]
+        self._pending_points.append(points)
+
+    async def _apply_points(self, points: int, activity_options: dict):
+        """Add one signal's points and persist them (runs started before batching)."""
         try:
             # Update points in workflow state
             self.points += points
@@ -75,13 +148,11 @@ class CustomerRewardsWorkflow:
             # Update rewards in MongoDB
             result = await workflow.execute_activity(
                 "update_user_rewards",
-                args=[self._user_id, self.points],
+                args=[self._user_id, points, str(workflow.uuid4())],
                 **activity_options
             )
             
             # Send notification about rewards update
-            # This notification is accessing the wrong information but the
-            #final one is correct
             await workflow.execute_activity(
                 "send_notification",
                 args=[self._user_id, "rewards_updated", f"Added {points} points. New total: {self.points}. Tier: {current_tier}"],
@@ -92,13 +163,62 @@ class CustomerRewardsWorkflow:
         except Exception as e:
             print(f"Failed to update rewards: {str(e)}")
             raise
+
+    async def _flush_points(self, activity_options: dict) -> bool:
+        """
+        Persist all queued points with one update_user_rewards call and send
+        one aggregated notification. A batch that failed is retried as is,
+        with the same id, before any points queued after it.
+        
+        Returns:
+            bool: False if the batch could not be persisted and is kept for a retry
+        """
+        if self._flushing is None:
+            self._flushing = {
+                "batch_id": str(workflow.uuid4()),
+                "points": self._pending_points
+            }
+            self._pending_points = []
+        batch = self._flushing["points"]
+        points_added = sum(batch)
+        
+        try:
+            # Update rewards in MongoDB with the batch total
+            await workflow.execute_activity(
+                "update_user_rewards",
+                args=[self._user_id, points_added, self._flushing["batch_id"]],
+                **activity_options
+            )
+        except Exception as e:
+            print(f"Failed to update rewards: {str(e)}")
+            return False
+        self._flushing = None
+        
+        # Update points in workflow state once they are persisted
+        self.points += points_added
+        
+        # Calculate current tier based on total points
+        current_tier = self._calculate_tier(self.points)
+        
+        # Send one notification for the whole batch
+        try:
+            await workflow.execute_activity(
+                "send_notification",
+                args=[self._user_id, "rewards_updated", f"Added {points_added} points from {len(batch)} orders. New total: {self.points}. Tier: {current_tier}"],
+                **activity_options
+            )
+        except Exception as e:
+            print(f"Failed to send rewards notification: {str(e)}")
+        
+        return True
             
     @workflow.signal
-    async def close_workflow(self):
+    def wake(self):
+        """Signal that only re-evaluates the workflow's wait, e.g. to retry a stored batch."""
+
+    @workflow.signal
+    def close_workflow(self):
         """Signal to gracefully close the workflow."""
-        if not self._initialized or not self._user_id:
-            raise ValueError("Workflow not properly initialized")
-        
         self._should_close = True
 
     @workflow.query
@@ -111,5 +231,6 @@ class CustomerRewardsWorkflow:
         """Query to get the current rewards status."""
         return {
             "points": self.points,
-            "tier": self._calculate_tier(self.points)
+            "tier": self._calculate_tier(self.points),
+            "pending_points": sum(self._pending_points) + (sum(self._flushing["points"]) if self._flushing else 0)
         } 
\ No newline at end of file
@@ -1,12 +1,28 @@
 from temporalio import workflow
 from temporalio.common import RetryPolicy
 from datetime import timedelta
-import random
+
+with workflow.unsafe.imports_passed_through():
+    from simulation import sample_delay
+
+# Timer lengths for workflows started without delays (before they were configurable)
+DEFAULT_DELAYS = {"pickup_wait": 2, "transit": 3}
+
+async def simulated_sleep(delays: dict, name: str):
+    """
+    Sleep for a simulated delay. The spec comes from the workflow arguments
+    and is sampled with workflow.random(), so a replay waits the same; a zero
+    delay creates no timer at all.
+    """
+    spec = (delays or DEFAULT_DELAYS).get(name, DEFAULT_DELAYS[name])
+    seconds = sample_delay(spec, workflow.random())
+    if seconds > 0:
+        await workflow.sleep(timedelta(seconds=seconds))
 
 @workflow.defn
 class ShippingWorkflow:
     @workflow.run
-    async def run(self, item: dict) -> dict:
+    async def run(self, item: dict, delays: dict = None) -> dict:
         # Simulate shipping process with potential failures
         retry_policy = RetryPolicy(
             initial_interval=timedelta(seconds=1),
@@ -29,7 +45,7 @@ class ShippingWorkflow:
             )
             
             # Simulate shipping delay
-            await workflow.sleep(timedelta(seconds=2))
+            await simulated_sleep(delays, "pickup_wait")
             
             # Schedule pickup
             pickup = await workflow.execute_activity(
@@ -39,7 +55,7 @@ class ShippingWorkflow:
             )
             
             # Simulate transit time
-            await workflow.sleep(timedelta(seconds=3))
+            await simulated_sleep(delays, "transit")
             
             # Mark as delivered
             delivery = await workflow.execute_activity(
@@ -59,4 +75,97 @@ class ShippingWorkflow:
             return {
                 "status": "failed",
                 "error": str(e)
-            } 
\ No newline at end of file
+            }
+
+def plan_parcels(order_id: str, items: list, max_items_per_parcel: int) -> list:
+    """
+    Group an order's items into parcels: one group per warehouse (items
+    without one share the default warehouse), split so no parcel holds more
+    than max_items_per_parcel line items.
+
+    Args:
+        order_id: Order the parcels belong to, used in parcel ids
+        items: Order items
+        max_items_per_parcel: Line items per parcel, 0 for no limit
+
+    Returns:
+        list: Parcels with 'parcel_id', 'warehouse' and 'items'
+    """
+    by_warehouse = {}
+    for item in items:
+        by_warehouse.setdefault(item.get('warehouse', 'default'), []).append(item)
+    
+    parcels = []
+    for warehouse, warehouse_items in by_warehouse.items():
+        size = max_items_per_parcel if max_items_per_parcel > 0 else len(warehouse_items)
+        for start in range(0, len(warehouse_items), size):
+            parcels.append({
+                "parcel_id": f"{order_id}_parcel_{len(parcels) + 1}",
+                "warehouse": warehouse,
+                "items": warehouse_items[start:start + size]
+            })
+    return parcels
+
+@workflow.defn
+class ParcelShippingWorkflow:
+    """
+    Ship a parcel of several items with one label, one pickup and one set of
+    transit timers, instead of a ShippingWorkflow per item.
+    """
+
+    @workflow.run
+    async def run(self, parcel: dict, delays: dict = None) -> dict:
+        retry_policy = RetryPolicy(
+            initial_interval=timedelta(seconds=1),
+            maximum_interval=timedelta(seconds=10),
+            maximum_attempts=3
+        )
+        
+        default_activity_options = {
+            "schedule_to_close_timeout": timedelta(seconds=5),
+            "retry_policy": retry_policy
+        }
+        
+        skus = [item['sku'] for item in parcel['items']]
+        try:
+            # One label covering every item in the parcel
+            label = await workflow.execute_activity(
+                "generate_parcel_label",
+                args=[parcel],
+                **default_activity_options
+            )
+            
+            # Simulate shipping delay
+            await simulated_sleep(delays, "pickup_wait")
+            
+            pickup = await workflow.execute_activity(
+                "schedule_pickup",
+                args=[label],
+                **default_activity_options
+            )
+            
+            # Simulate transit time
+            await simulated_sleep(delays, "transit")
+            
+            delivery = await workflow.execute_activity(
+                "mark_delivered",
+                args=[label],
+                **default_activity_options
+            )
+            
+            return {
+                "status": "delivered",
+                "parcel_id": parcel['parcel_id'],
+                "skus": skus,
+                "tracking_number": label,
+                "pickup_status": pickup,
+                "delivery_status": delivery
+            }
+            
+        except Exception as e:
+            return {
+                "status": "failed",
+                "parcel_id": parcel['parcel_id'],
+                "skus": skus,
+                "error": str(e)
+            }